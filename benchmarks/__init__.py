@@ -0,0 +1,6 @@
+"""
+Benchmarks that run without Sublime Text, using the stand-in for its API in fake_sublime.
+
+Run them from the root of the repository, e.g.:
+    python -m benchmarks.bench_registry
+"""
@@ -0,0 +1,44 @@
+"""
+Time of adding, removing and toggling a single word in a collection of a given size.
+The words are indexed by regex and the colors are counted as words are added and removed,
+so the time should not grow with the number of words.
+"""
+from benchmarks import fake_sublime
+import timeit
+
+src = fake_sublime.load_package()
+core = src.core
+helpers = src.helpers
+
+def make_collection(word_count):
+    collection = core.WordHighlightCollection(fake_sublime.View())
+    for i in range(word_count):
+        collection._add_word(core.WordHighlight("word{}".format(i), literal_match=True, match_by_word=True))
+    return collection
+
+def make_word():
+    return core.WordHighlight("extra", literal_match=True, match_by_word=True)
+
+def add_remove(collection):
+    word = make_word()
+    collection._add_word(word)
+    collection._remove_word(word)
+    collection.removed_words.clear()
+
+def toggle(collection):
+    word = make_word()
+    collection.toggle_word(word)
+    collection.toggle_word(word)
+    collection.removed_words.clear()
+
+def main(word_counts=(10, 1000, 10000), repeat=5, number=1000):
+    helpers.get_settings().set("color_picking_scheme", "CYCLIC_EVEN")
+    print("{:>8} {:>18} {:>18}".format("words", "add+remove [us]", "toggle x2 [us]"))
+    for word_count in word_counts:
+        collection = make_collection(word_count)
+        add_remove_time = min(timeit.repeat(lambda: add_remove(collection), number=number, repeat=repeat)) / number
+        toggle_time = min(timeit.repeat(lambda: toggle(collection), number=number, repeat=repeat)) / number
+        print("{:>8} {:>18.1f} {:>18.1f}".format(word_count, add_remove_time * 1e6, toggle_time * 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Peak memory of scanning and updating a buffer where the highlighted words match very often.
+The matches of a scan are kept as arrays of begin and end points, and Region objects are only created
+for one key at a time when it is published. This is compared to holding the matches as lists of regions.
+Sublime Text keeps the published regions on its own side, so the stand-in forgets them here.
+"""
+from benchmarks import fake_sublime
+import tracemalloc
+
+src = fake_sublime.load_package()
+core = src.core
+engine = src.engine
+helpers = src.helpers
+
+def make_view(size):
+    line = "for i in range(n): x = i + x  # word1 word2 word3\n"
+    view = fake_sublime.View(line * (size // len(line)))
+    view.add_regions = lambda key, regions, *args, **kwargs: None
+    return view
+
+def make_collection(view):
+    collection = core.WordHighlightCollection(view)
+    for w in ["i", "x", "word1", "word2", "word3", "in", "for", "range", "n"]:
+        collection._add_word(core.WordHighlight(w, literal_match=True, match_by_word=True))
+    return collection
+
+def peak_memory(function):
+    """Peak memory allocated while running the function [bytes], and its result"""
+    tracemalloc.start()
+    try:
+        result = function()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+def main(size=5 * 1024 ** 2):
+    view = make_view(size)
+    collection = make_collection(view)
+    helpers.get_settings().set("progressive_update", False)
+    helpers.get_settings().set("viewport_update", False)
+    engine.get_snapshot(view)
+
+    compact, found = peak_memory(lambda: engine.scan_regions(view, collection.words))
+    match_count = sum(len(m) for m in found.values())
+    del found
+    as_regions, found = peak_memory(lambda: {r: m.to_regions() for r, m in engine.scan_regions(view, collection.words).items()})
+    del found
+    engine.match_cache.forget(view.buffer_id())
+    update, _ = peak_memory(collection.update)
+
+    print("{} matches in {:.0f} MB".format(match_count, size / 1024 ** 2))
+    print("{:>32} {:>10.1f} MB".format("scan, arrays", compact / 1024 ** 2))
+    print("{:>32} {:>10.1f} MB".format("scan, lists of regions", as_regions / 1024 ** 2))
+    print("{:>32} {:>10.1f} MB".format("update, arrays", update / 1024 ** 2))
+
+if __name__ == "__main__":
+    main()
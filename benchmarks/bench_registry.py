@@ -0,0 +1,36 @@
+"""
+Per-command overhead of getting the collection of a view and storing it again, when pickling it
+through the view settings (as before the registry) compared to the in-memory collection registry.
+"""
+from benchmarks import fake_sublime
+import timeit
+
+src = fake_sublime.load_package()
+core = src.core
+
+def make_collection(word_count):
+    view = fake_sublime.View()
+    collection = core.WordHighlightCollection(view)
+    for i in range(word_count):
+        collection._add_word(core.WordHighlight("word{}".format(i), literal_match=True, match_by_word=True))
+    collection.save()
+    collection.serialize()
+    return view, collection
+
+def pickled_round_trip(view):
+    core.WordHighlightCollection.deserialize(view).serialize()
+
+def registry_round_trip(view):
+    core.WordHighlightCollection.load(view).save()
+
+def main(word_counts=(10, 100, 1000, 10000), repeat=5):
+    print("{:>8} {:>16} {:>16} {:>10}".format("words", "pickled [us]", "registry [us]", "speedup"))
+    for word_count in word_counts:
+        view, collection = make_collection(word_count)
+        number = max(1, 10000 // word_count)
+        pickled = min(timeit.repeat(lambda: pickled_round_trip(view), number=number, repeat=repeat)) / number
+        registry = min(timeit.repeat(lambda: registry_round_trip(view), number=number, repeat=repeat)) / number
+        print("{:>8} {:>16.1f} {:>16.1f} {:>10.0f}".format(word_count, pickled * 1e6, registry * 1e6, pickled / registry))
+
+if __name__ == "__main__":
+    main()
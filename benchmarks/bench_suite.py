@@ -0,0 +1,163 @@
+"""
+Benchmarks of the core highlighting paths, for buffers of different sizes with different numbers of highlighted words.
+The sizes cover each update mode: small buffers are scanned at once, buffers above progressive_update_size are
+scanned progressively in chunks, and buffers above viewport_update_size only around the visible region.
+The results are saved as JSON, so that the runs of two commits can be compared:
+    python -m benchmarks.bench_suite --output before.json
+    python -m benchmarks.bench_suite --output after.json --compare before.json
+"""
+from benchmarks import fake_sublime
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+
+src = fake_sublime.load_package()
+core = src.core
+engine = src.engine
+helpers = src.helpers
+
+SIZES = {"10KB": 10 * 1024, "1MB": 1024 ** 2, "10MB": 10 * 1024 ** 2, "50MB": 50 * 1024 ** 2}
+WORD_COUNTS = (10, 100, 1000)
+VOCABULARY = ["word{}".format(i) for i in range(2000)] + ["x.y", "(call)", "a-b", "{", "}", ";"]
+
+def make_text(size, seed=0):
+    """Random lines of words from the vocabulary, repeated up to the size"""
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < min(size, 1 << 16):
+        line = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(4, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    block = "\n".join(lines) + "\n"
+    return (block * (size // len(block) + 1))[:size]
+
+def make_collection(text, word_count):
+    view = fake_sublime.View(text)
+    collection = core.WordHighlightCollection(view)
+    for w in VOCABULARY[:word_count]:
+        collection._add_word(core.WordHighlight(w, literal_match=True, match_by_word=True))
+    collection.save()
+    return view, collection
+
+def get_mode(view):
+    """The update mode of the view: a full scan, a progressive scan of the whole buffer, or the viewport only"""
+    if core.is_viewport_update(view):
+        return "viewport"
+    settings = helpers.get_settings()
+    if settings.get("progressive_update", True) and view.size() > settings.get("progressive_update_size", 1000000):
+        return "progressive"
+    return "full"
+
+def forget_published(view, collection):
+    """Makes the next update scan and publish everything again, like after reloading the plugin"""
+    core.publishers.pop(view.id(), None)
+    engine.forget_snapshot(view)
+    collection.published = None
+
+def bench_update(view, collection):
+    forget_published(view, collection)
+    start = time.perf_counter()
+    collection.update()
+    return time.perf_counter() - start
+
+def bench_update_after_insert(view, collection):
+    point = view.size() // 2
+    view.insert(point, "word1 ")
+    start = time.perf_counter()
+    collection.update([fake_sublime.Region(point, point + len("word1 "))])
+    return time.perf_counter() - start
+
+def bench_toggle_word(view, collection):
+    word = core.WordHighlight(VOCABULARY[-7], literal_match=True, match_by_word=True)
+    start = time.perf_counter()
+    collection.toggle_word(word)
+    collection.update()
+    return time.perf_counter() - start
+
+def bench_restore(view, collection):
+    engine.forget_snapshot(view)
+    start = time.perf_counter()
+    core.WordHighlightCollection.restore(view)
+    return time.perf_counter() - start
+
+def bench_expand_to_word(view, collection, count=1000):
+    rng = random.Random(1)
+    points = [rng.randrange(view.size()) for _ in range(count)]
+    start = time.perf_counter()
+    for p in points:
+        core.expand_to_word(view, p)
+    return (time.perf_counter() - start) / count
+
+def bench_save_load(view, collection):
+    start = time.perf_counter()
+    collection.serialize()
+    core.WordHighlightCollection.deserialize(view)
+    return time.perf_counter() - start
+
+BENCHMARKS = [
+    ("update", bench_update),
+    ("update_after_insert", bench_update_after_insert),
+    ("toggle_word", bench_toggle_word),
+    ("restore", bench_restore),
+    ("expand_to_word", bench_expand_to_word),
+    ("save_load", bench_save_load),
+]
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=fake_sublime._repository, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, word_counts, names, repeat):
+    results = []
+    for size_name in sizes:
+        text = make_text(SIZES[size_name])
+        for word_count in word_counts:
+            view, collection = make_collection(text, word_count)
+            mode = get_mode(view)
+            collection.update()
+            for name, benchmark in BENCHMARKS:
+                if name not in names:
+                    continue
+                times = [benchmark(view, collection) for _ in range(repeat)]
+                result = {"name": name, "size": size_name, "mode": mode, "words": word_count, "min": min(times), "mean": sum(times) / len(times), "runs": len(times)}
+                print("{:>20} {:>6} {:>11} {:>6} words {:>12.3f} ms".format(name, size_name, mode, word_count, result["min"] * 1000))
+                results.append(result)
+            core.forget_collection(view)
+            engine.forget_snapshot(view)
+    return results
+
+def compare(results, baseline):
+    """Prints the ratio of the time of each benchmark to the baseline, where above 1 means slower"""
+    previous = {(r["name"], r["size"], r["words"]): r["min"] for r in baseline["results"]}
+    print("Compared to commit {}:".format(baseline.get("commit")))
+    for r in results:
+        key = (r["name"], r["size"], r["words"])
+        if key in previous and previous[key] > 0:
+            print("{:>20} {:>6} {:>6} words {:>8.2f}x".format(r["name"], r["size"], r["words"], r["min"] / previous[key]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(sorted(SIZES, key=SIZES.get)), help="Comma separated buffer sizes among {}".format(", ".join(sorted(SIZES, key=SIZES.get))))
+    parser.add_argument("--words", default=",".join(str(w) for w in WORD_COUNTS), help="Comma separated numbers of highlighted words")
+    parser.add_argument("--benchmarks", default=",".join(name for name, _ in BENCHMARKS), help="Comma separated benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark")
+    parser.add_argument("--output", default="bench_results.json", help="File to save the results to")
+    parser.add_argument("--compare", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run(args.sizes.split(","), [int(w) for w in args.words.split(",")], args.benchmarks.split(","), args.repeat)
+    output = {"commit": get_commit(), "python": platform.python_version(), "platform": platform.platform(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
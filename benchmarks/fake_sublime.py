@@ -0,0 +1,409 @@
+"""
+In-memory stand-in for the parts of the sublime API that the plugin uses, backed by a Python string
+"""
+import bisect
+import collections
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import types
+
+CLASS_WORD_START = 1
+CLASS_WORD_END = 2
+CLASS_PUNCTUATION_START = 4
+CLASS_PUNCTUATION_END = 8
+CLASS_SUB_WORD_START = 16
+CLASS_SUB_WORD_END = 32
+CLASS_LINE_START = 64
+CLASS_LINE_END = 128
+CLASS_EMPTY_LINE = 256
+
+LITERAL = 1
+IGNORECASE = 2
+
+HIDDEN = 128
+MONOSPACE_FONT = 1
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+
+# The default word_separators setting of Sublime Text
+WORD_SEPARATORS = "./\\()\"'-:,.;<>~!@#$%^&*|+=[]{}`~?"
+
+_ids = itertools.count(1)
+_packages_path = tempfile.mkdtemp(prefix="word_highlighter_benchmarks_")
+_settings = {}
+_clipboard = ""
+# Callbacks of set_timeout and set_timeout_async that have not run yet
+_callbacks = collections.deque()
+_running_callbacks = False
+_repository = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+class Region(object):
+    __slots__ = ("a", "b", "xpos")
+
+    def __init__(self, a, b=None):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def cover(self, region):
+        return Region(min(self.begin(), region.begin()), max(self.end(), region.end()))
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, region):
+        if self.begin() == region.begin() and self.end() == region.end():
+            return True
+        return region.begin() < self.end() and region.end() > self.begin()
+
+    def intersection(self, region):
+        if not self.intersects(region):
+            return Region(0, 0)
+        return Region(max(self.begin(), region.begin()), min(self.end(), region.end()))
+
+    def __eq__(self, region):
+        return isinstance(region, Region) and self.a == region.a and self.b == region.b
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __len__(self):
+        return self.size()
+
+    def __repr__(self):
+        return "({}, {})".format(self.a, self.b)
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def add_on_change(self, key, callback):
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        self.callbacks.pop(key, None)
+
+class Selection(object):
+    def __init__(self):
+        self.regions = []
+
+    def add(self, region):
+        if not isinstance(region, Region):
+            region = Region(region)
+        self.regions.append(region)
+        self.regions.sort(key=lambda r: r.begin())
+
+    def clear(self):
+        self.regions = []
+
+    def __iter__(self):
+        return iter(list(self.regions))
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, index):
+        return self.regions[index]
+
+class Buffer(object):
+    """The text that is shared by all views of the same file"""
+    def __init__(self, text):
+        self.buffer_id = next(_ids)
+        self.text = text
+        self.change_count = 0
+        self.views = []
+        self._line_starts = None
+
+    def line_starts(self):
+        """The points where each line starts, only computed once per change"""
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer("\n", self.text)]
+        return self._line_starts
+
+    def replace(self, region, text):
+        self.text = self.text[:region.begin()] + text + self.text[region.end():]
+        self.change_count += 1
+        self._line_starts = None
+        for view in self.views:
+            view._shift_regions(region, len(text))
+
+class View(object):
+    def __init__(self, text="", buffer=None, window=None):
+        self.view_id = next(_ids)
+        self.buffer = Buffer(text) if buffer is None else buffer
+        self.buffer.views.append(self)
+        self._settings = Settings()
+        self._sel = Selection()
+        self._window = window
+        self.regions = {}
+        self.visible = None
+
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self.buffer.buffer_id
+
+    # Like in Sublime Text, only the id of a view is pickled
+    def __getstate__(self):
+        return {"view_id": self.view_id}
+
+    @property
+    def text(self):
+        return self.buffer.text
+
+    def is_valid(self):
+        return True
+
+    def is_loading(self):
+        return False
+
+    def file_name(self):
+        return None
+
+    def window(self):
+        return self._window
+
+    def settings(self):
+        return self._settings
+
+    def sel(self):
+        return self._sel
+
+    def size(self):
+        return len(self.text)
+
+    def change_count(self):
+        return self.buffer.change_count
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x+1]
+
+    def insert(self, point, text):
+        """Inserts text like the insert command, moving the regions after it"""
+        self.buffer.replace(Region(point, point), text)
+
+    def erase(self, region):
+        self.buffer.replace(region, "")
+
+    def find_all(self, pattern, flags=0, fmt=None, extractions=None):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        regex_flags = re.MULTILINE | (re.IGNORECASE if flags & IGNORECASE else 0)
+        regions = []
+        for m in re.finditer(pattern, self.text, regex_flags):
+            regions.append(Region(m.start(), m.end()))
+            if extractions is not None:
+                extractions.append(m.expand(fmt.replace("$", "\\")) if fmt else m.group())
+        return regions
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        self.regions[key] = sorted(regions, key=lambda r: (r.begin(), r.end()))
+
+    def get_regions(self, key):
+        return list(self.regions.get(key, []))
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def _shift_regions(self, edited, inserted_length):
+        delta = inserted_length - edited.size()
+        def shift(point):
+            if point >= edited.end():
+                return point + delta
+            return min(point, edited.begin() + inserted_length)
+        for key, regions in self.regions.items():
+            self.regions[key] = [Region(shift(r.a), shift(r.b)) for r in regions]
+        self._sel.regions = [Region(shift(r.a), shift(r.b)) for r in self._sel.regions]
+
+    def visible_region(self):
+        return self.visible or Region(0, min(self.size(), 4000))
+
+    def rowcol(self, point):
+        line_starts = self.buffer.line_starts()
+        row = bisect.bisect_right(line_starts, point) - 1
+        return (row, point - line_starts[row])
+
+    def text_point(self, row, col):
+        line_starts = self.buffer.line_starts()
+        if row >= len(line_starts):
+            return self.size()
+        return min(line_starts[row] + col, self.size())
+
+    def line(self, x):
+        begin, end = (x.begin(), x.end()) if isinstance(x, Region) else (x, x)
+        line_end = self.text.find("\n", end)
+        return Region(self.text.rfind("\n", 0, begin) + 1, self.size() if line_end < 0 else line_end)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.begin(), min(line.end() + 1, self.size()))
+
+    def classify(self, point):
+        before = self.text[point-1] if point > 0 else ""
+        after = self.text[point] if point < self.size() else ""
+        def is_word(c):
+            return c != "" and not c.isspace() and c not in WORD_SEPARATORS
+        def is_punctuation(c):
+            return c != "" and c in WORD_SEPARATORS
+        classes = 0
+        if is_word(after) and not is_word(before):
+            classes |= CLASS_WORD_START
+        if is_word(before) and not is_word(after):
+            classes |= CLASS_WORD_END
+        if is_punctuation(after) and not is_punctuation(before):
+            classes |= CLASS_PUNCTUATION_START
+        if is_punctuation(before) and not is_punctuation(after):
+            classes |= CLASS_PUNCTUATION_END
+        if before in ("", "\n"):
+            classes |= CLASS_LINE_START
+        if after in ("", "\n"):
+            classes |= CLASS_LINE_END
+        if before in ("", "\n") and after in ("", "\n"):
+            classes |= CLASS_EMPTY_LINE
+        return classes
+
+    def find_by_class(self, point, forward, classes, separators=""):
+        step = 1 if forward else -1
+        point += step
+        while 0 < point < self.size():
+            if self.classify(point) & classes:
+                return point
+            point += step
+        return max(0, min(point, self.size()))
+
+    def show(self, *args, **kwargs):
+        pass
+
+    def show_popup(self, *args, **kwargs):
+        pass
+
+    def hide_popup(self):
+        pass
+
+    def run_command(self, *args, **kwargs):
+        pass
+
+class Window(object):
+    def __init__(self):
+        self.window_id = next(_ids)
+        self._views = []
+
+    def id(self):
+        return self.window_id
+
+    def new_file(self, text=""):
+        view = View(text, window=self)
+        self._views.append(view)
+        return view
+
+    def views(self):
+        return list(self._views)
+
+    def folders(self):
+        return []
+
+def packages_path():
+    return _packages_path
+
+def _load_json_with_comments(path):
+    with open(path) as f:
+        contents = f.read()
+    contents = re.sub(r'^\s*//.*$', '', contents, flags=re.MULTILINE)
+    contents = re.sub(r',(\s*[}\]])', r'\1', contents)
+    return json.loads(contents)
+
+def load_settings(name):
+    if name not in _settings:
+        path = os.path.join(_repository, name)
+        _settings[name] = Settings(_load_json_with_comments(path) if os.path.exists(path) else {})
+    return _settings[name]
+
+def save_settings(name):
+    pass
+
+def load_resource(name):
+    # Resources are named like Packages/word_highlighter/<path>
+    with open(os.path.join(_repository, name.split("/", 2)[2])) as f:
+        return f.read()
+
+def get_clipboard():
+    return _clipboard
+
+def set_clipboard(text):
+    global _clipboard
+    _clipboard = text
+
+def status_message(message):
+    pass
+
+def _run_soon(callback):
+    """Runs the callback after the running callback, or right away if none is running, ignoring the delay"""
+    global _running_callbacks
+    _callbacks.append(callback)
+    if _running_callbacks:
+        return
+    _running_callbacks = True
+    try:
+        while _callbacks:
+            _callbacks.popleft()()
+    finally:
+        _running_callbacks = False
+
+def set_timeout(callback, delay=0):
+    _run_soon(callback)
+
+def set_timeout_async(callback, delay=0):
+    _run_soon(callback)
+
+def _make_sublime_plugin():
+    module = types.ModuleType("sublime_plugin")
+    for name in ("TextCommand", "WindowCommand", "ApplicationCommand", "EventListener", "ViewEventListener"):
+        setattr(module, name, type(name, (object,), {}))
+    return module
+
+def load_package():
+    """Installs the stand-in as the sublime module and imports the plugin's src package"""
+    sys.modules["sublime"] = sys.modules[__name__]
+    sys.modules["sublime_plugin"] = _make_sublime_plugin()
+    if _repository not in sys.path:
+        sys.path.insert(0, _repository)
+    import src.helpers, src.core, src.engine, src.stats
+    for module in (src.helpers, src.core, src.engine, src.stats):
+        module.plugin_loaded()
+    return src
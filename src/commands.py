@@ -1,13 +1,14 @@
 import sublime
 import sublime_plugin
 from . import core
-
-# For automatically creating color schemes for the highlighter
-import shutil
-import os
+from . import engine
+from . import stats
+from . import occurrences
 
 # For updating the highlighting on modifications of text
-import threading
+import functools
+import time
+from . import worker
 
 from . import helpers
 logger = None
@@ -17,16 +18,14 @@ is_loaded = False
 sublime.INDEX_NONE_CHOSEN = -1
 sublime.POPUP_LOCATION_AT_CURSOR = -1
 
-import re
-
 def plugin_loaded():
     global logger, is_loaded
     helpers.plugin_loaded()
     logger = helpers.get_logger()
     logger.info("Loading " + __name__)
     settings = helpers.get_settings()
-    logger.info("Color picking scheme: {}".format(settings.get("color_picking_scheme")))
-    logger.info("Debounce time: {}".format(settings.get("debounce")))
+    logger.info("Color picking scheme: %s", settings.get("color_picking_scheme"))
+    logger.info("Debounce time: %s (adaptive: %s, min: %s, max: %s, CPU share: %s)", settings.get("debounce"), settings.get("adaptive_debounce"), settings.get("debounce_min"), settings.get("debounce_max"), settings.get("debounce_cpu_share"))
     is_loaded = True
 
 class WordHighlighterWordColorMenu(sublime_plugin.TextCommand, core.CollectionableMixin):
@@ -35,15 +34,29 @@ class WordHighlighterWordColorMenu(sublime_plugin.TextCommand, core.Collectionab
         self.collection._remove_word(word) # Make sure to remove old highlight
         word.set_color(color)
         self.collection._add_word(word)
-        self.collection.update()
+        self.collection.submit_update()
         self.save_collection()
         self.view.hide_popup()
 
-    def show_word_color_menu(self, word, location=sublime.POPUP_LOCATION_AT_CURSOR):
+    # The contents of the menu of each color scheme, as (colors, HTML) by the color scheme setting
+    menu_contents = {}
+
+    def get_word_color_menu_content(self):
+        """The HTML of the menu, only built again when the palette of the color scheme has been resolved again"""
+        color_scheme = self.view.settings().get("color_scheme")
+        colors = core.get_colors(self.view)
+        cached = WordHighlighterWordColorMenu.menu_contents.get(color_scheme)
+        if cached is not None and cached[0] is colors:
+            return cached[1]
         content = "<h3>Change highlight color</h3>"
         link_template = "<a href=\"{color_name}\" style=\"color:{foreground};background-color:{background}\">{disp_name}</a><br>"
-        for idx, color in enumerate(core.get_colors(self.view)):
+        for color in colors:
             content += link_template.format(color_name=color.scope, disp_name=color.name, foreground=color.foreground, background=color.background)
+        WordHighlighterWordColorMenu.menu_contents[color_scheme] = (colors, content)
+        return content
+
+    def show_word_color_menu(self, word, location=sublime.POPUP_LOCATION_AT_CURSOR):
+        content = self.get_word_color_menu_content()
         self.view.show_popup(content, sublime.HIDE_ON_MOUSE_MOVE_AWAY, location=location, max_width=500, max_height=500, on_navigate=save_argument_wrapper(self.navigate, word))
 
     def run(self, edit):
@@ -52,14 +65,71 @@ class WordHighlighterWordColorMenu(sublime_plugin.TextCommand, core.Collectionab
     def _run(self):
         self.load_collection()
 
+        sel = [sublime.Region(sr.begin()-1, sr.end()+1) for sr in self.view.sel()]
+        for sr, hits in zip(sel, self.collection.get_words_at(sel)):
+            if hits:
+                w, wr = hits[0]
+                self.show_word_color_menu(w, min(sr.end(), wr.end()))
+                return
+
+class WordHighlighterGotoNext(sublime_plugin.TextCommand, core.CollectionableMixin):
+    """
+    Jumps to the next occurrence of the highlight under the cursor, or of any highlight if the cursor is not on one,
+    wrapping around at the end of the buffer. The occurrences are found by bisecting into the match index of the
+    collection, so a jump does not scan the buffer. The index covers the whole buffer, except for files that are
+    so large that only the lines around the visible region are highlighted, where the jump stays within them.
+    """
+    forward = True
+
+    def run(self, edit, any_highlight=False):
+        self.load_collection()
         sel = self.view.sel()
-        for sr in sel:
-            sr = sublime.Region(sr.begin()-1, sr.end()+1)
-            for w in self.collection.words:
-                for wr in w.find_all_regions(self.view):
-                    if wr.intersects(sr):
-                        self.show_word_color_menu(w, min(sr.end(), wr.end()))
-                        return
+        if not len(sel) or not self.collection.words:
+            return
+        cursor = sel[len(sel)-1] if self.forward else sel[0]
+        point = cursor.begin()
+        index = self.collection.get_match_index()
+        if index is None:
+            sublime.status_message("Word Highlighter: the highlights are still being updated")
+            return
+        hits = index.regexes_at(cursor.begin()-1, cursor.end()+1)
+        regex = None
+        if hits:
+            # Going back from within an occurrence skips the occurrence itself
+            point = min(point, hits[0][1].begin())
+            if not any_highlight:
+                regex = hits[0][0]
+        target = self.find_target(index, regex, point)
+        if target is None:
+            if index.window is None:
+                sublime.status_message("Word Highlighter: there are no occurrences of the highlights")
+            else:
+                sublime.status_message("Word Highlighter: there are no more occurrences of the highlights near the visible region")
+            return
+        sel.clear()
+        sel.add(target)
+        self.view.show(target)
+
+    def find_target(self, index, regex, point):
+        """
+        The next (or previous) occurrence of the regex, or of any regex if None, in the match index
+        @param index engine.MatchIndex of the collection, which is only wrapped around if it covers the whole buffer
+        """
+        if self.forward:
+            target = index.next_after(point, regex)
+            # Wrap around to the first occurrence in the buffer
+            if target is None and index.window is None:
+                target = index.next_after(-1, regex)
+            return target
+        target = index.previous_before(point, regex)
+        # Wrap around to the last occurrence in the buffer
+        if target is None and index.window is None:
+            target = index.previous_before(self.view.size() + 1, regex)
+        return target
+
+class WordHighlighterGotoPrevious(WordHighlighterGotoNext):
+    """Jumps to the previous occurrence, like WordHighlighterGotoNext"""
+    forward = False
 
 class WordHighlighterUpdateHighlightsEvent(sublime_plugin.ViewEventListener, core.CollectionableMixin):
     '''
@@ -67,20 +137,87 @@ class WordHighlighterUpdateHighlightsEvent(sublime_plugin.ViewEventListener, cor
     '''
     def __init__(self, view):
         self.view = view
-        settings = helpers.get_settings()
-        self.debounce_time = settings.get("debounce")
-        self.debouncer = None
+        self.debounce = worker.AdaptiveDebounce(view)
+        self.update_count = 0
+        self.dirty_regions = core.DirtyRegions(view)
+        self.text_command = (None, None)
+        self.size = view.size()
+        self.modified_time = 0
+        # Bumped when the view is activated or deactivated, which stops the earlier polling of the viewport
+        self.viewport_generation = 0
+        self.buffer_id = view.buffer_id()
 
-    @core.CollectionableMixin.update_collection_nonreentrant
     def update_highlighting(self):
         logger.debug("Updating highlighting")
-        self.collection.update()
+        self.load_collection()
+        # The dirty regions are only cleared once the scan has been committed, since it is dropped if the text changes
+        job = worker.ScanJob(self.collection, self.dirty_regions.get(), on_commit=self.dirty_regions.clear, on_cost=self.debounce.add_cost)
+        worker.worker.submit(job)
+
+    def on_debounced(self, update_count):
+        # Only the last modification within the debounce time triggers an update
+        if update_count == self.update_count:
+            if stats.enabled:
+                stats.record(self.view, "debounce_wait", time.perf_counter() - self.modified_time)
+            self.update_highlighting()
+
+    def on_load(self):
+        self.apply_window_set()
+
+    def on_activated(self):
+        self.apply_window_set()
+        self.viewport_generation += 1
+        self.follow_viewport(self.viewport_generation)
+
+    def on_deactivated(self):
+        self.viewport_generation += 1
+
+    def apply_window_set(self):
+        """Highlights the words of the window in views that were opened after they were added"""
+        window = self.view.window()
+        if window is not None and window.id() in core.window_sets:
+            apply_window_set_to_view(self.view, core.window_sets[window.id()])
+
+    def follow_viewport(self, generation):
+        """
+        Polls the visible region while the view is active, since there is no event for scrolling.
+        Rescans the region around it when it gets close to the edge of the highlighted window.
+        @param generation The viewport generation that the polling was started in, it stops in any other
+        """
+        if generation != self.viewport_generation or not self.view.is_valid():
+            return
+        if core.is_viewport_update(self.view) and not core.get_publisher(self.view).is_viewport_covered():
+            self.update_highlighting()
+        interval = helpers.get_settings().get("viewport_poll_interval", 0.1)
+        sublime.set_timeout(functools.partial(self.follow_viewport, generation), int(interval * 1000))
+
+    def on_text_command(self, command_name, args):
+        self.text_command = (command_name, args)
+        self.size = self.view.size()
+
+    def on_post_text_command(self, command_name, args):
+        self.text_command = (None, None)
+
+    def on_post_save(self):
+        core.serialize_collection(self.view)
+
+    def on_pre_close(self):
+        core.serialize_collection(self.view)
+
+    def on_close(self):
+        core.forget_collection(self.view)
+        # Clones of the view share its buffer, and keep using its cached matches
+        engine.forget_closed_buffer(self.view, self.buffer_id)
+        stats.log_summary(self.view)
+        stats.forget_stats(self.view)
 
     def on_modified(self):
-        if self.debouncer is not None:
-            self.debouncer.cancel()
-        self.debouncer = threading.Timer(self.debounce_time, self.update_highlighting)
-        self.debouncer.start()
+        size = self.view.size()
+        self.dirty_regions.add_edit(self.text_command[0], self.text_command[1], size - self.size)
+        self.size = size
+        self.modified_time = time.perf_counter()
+        self.update_count += 1
+        sublime.set_timeout(functools.partial(self.on_debounced, self.update_count), int(self.debounce.get_delay() * 1000))
 
 class WordHighlighterUpdateColorSchemeEvent(sublime_plugin.ViewEventListener):
     def __init__(self, view):
@@ -104,14 +241,40 @@ class WordHighlighterUpdateColorSchemeEvent(sublime_plugin.ViewEventListener):
         if current_color_scheme == self.last_color_scheme:
             return
 
-        logger.info("Adding color scheme {}".format(current_color_scheme))
-        scheme_name = os.path.splitext(os.path.basename(current_color_scheme))[0]
-        scheme_dest_path = os.path.join(helpers.dirs.color_schemes, scheme_name + os.extsep + "sublime-color-scheme")
-        template_contents = sublime.load_resource("Packages/word_highlighter/word_highlighter.template-sublime-color-scheme")
-        with open(scheme_dest_path, "w") as f:
-            f.write(template_contents)
+        # All views with the same color scheme share the generated file, which is only written when it changes
+        core.color_scheme_cache.write_scheme(current_color_scheme)
         self.last_color_scheme = current_color_scheme
 
+class WordHighlighterShowStats(sublime_plugin.TextCommand):
+    """
+    Shows the timing stats of the phases of updating the highlights of the view in an output panel,
+    and writes them to the log
+    """
+    def run(self, edit):
+        stats.log_summary(self.view)
+        window = self.view.window()
+        panel = window.create_output_panel("word_highlighter_stats")
+        panel.run_command("append", {"characters": stats.get_summary(self.view)})
+        window.run_command("show_panel", {"panel": "output.word_highlighter_stats"})
+
+class WordHighlighterIndexProjectOccurrences(sublime_plugin.WindowCommand):
+    """
+    Lists the lines that the highlights of the active view occur on in all files of the project folders,
+    and counts their occurrences
+    """
+    def run(self):
+        view = self.window.active_view()
+        if view is None:
+            return
+        words = core.WordHighlightCollection.load(view).words
+        if not words:
+            sublime.status_message("Word Highlighter: there are no highlights to index")
+            return
+        if not self.window.folders():
+            sublime.status_message("Word Highlighter: there are no project folders to index")
+            return
+        occurrences.ProjectIndexer(self.window, words).start()
+
 class WordHighlighterClearInstances(sublime_plugin.TextCommand, core.CollectionableMixin):
     def __init__(self, view):
         self.view = view
@@ -127,12 +290,19 @@ def save_argument_wrapper(callback, *const_args, **const_kwargs):
         return callback(*args, **kwargs)
     return saved_argument_callback
 
+def get_word_label(buffer_id, word):
+    """The regex of the word as it is listed in the menus, marked if it is suspended for being too slow"""
+    cost = engine.budget.get_cost(buffer_id, word.get_regex())
+    if cost is None:
+        return word.get_regex()
+    return "{}  [too slow: {:.1f} s, {} matches]".format(word.get_regex(), *cost)
+
 # Menu for clearing highlighted words
 class WordHighlighterClearMenu(sublime_plugin.TextCommand, core.CollectionableMixin):
     @core.CollectionableMixin.update_collection_nonreentrant
     def _clear_word(self, original_words, chosen_index):
         self.collection._remove_word(original_words[chosen_index])
-        self.collection.update()
+        self.collection.submit_update()
 
     def clear_word(self, original_words, chosen_index):
         if chosen_index == sublime.INDEX_NONE_CHOSEN:
@@ -144,7 +314,8 @@ class WordHighlighterClearMenu(sublime_plugin.TextCommand, core.CollectionableMi
     def _run(self, index=0):
         self.load_collection()
         words = [w for w in self.collection.words]
-        word_strings = [w.get_regex() for w in words]
+        buffer_id = self.view.buffer_id()
+        word_strings = [get_word_label(buffer_id, w) for w in words]
         self.view.window().show_quick_panel(word_strings, save_argument_wrapper(self.clear_word, words), sublime.MONOSPACE_FONT, selected_index=index)
 
     def run(self, edit, index=0):
@@ -157,35 +328,80 @@ class WordHighlighterHighlightInstancesOfSelection(sublime_plugin.TextCommand, c
     def __init__(self, view):
         self.view = view
         self.collection = core.WordHighlightCollection.restore(view)
-        self.collection.update()
+        self.collection.submit_update()
         self.save_collection()
 
     def run(self, edit):
-        text_selections = []
-        for s in self.view.sel():
-            # Expand empty selections to words
-            if s.empty():
-                r = core.expand_to_word(self.view, s.begin())
-                # Append the word if it is not empty
-                txt = self.view.substr(r)
-                if txt != '':
-                    logger.debug("Expanded word is valid: '{}'".format(txt))
-                    text_selections.append(core.WordHighlight(txt, match_by_word=True, literal_match=True))
-            # Keep non-empty selections as-is
-            else:
-                text_selections.append(core.WordHighlight(self.view.substr(s), match_by_word=False, literal_match=True))
-        # Get unique items
-        text_selections = list(set(text_selections))
-
-        logger.debug("text_selections: " + str(text_selections))
+        text_selections = get_selection_words(self.view)
+        logger.debug("text_selections: %s", text_selections)
 
         # Find all instances of each selection
         self.load_collection()
         for w in text_selections:
             self.collection.toggle_word(w)
-        self.collection.update()
+        self.collection.submit_update()
         self.save_collection()
 
+def get_selection_words(view):
+    """The unique words to highlight for the selections, where empty selections are expanded to whole words"""
+    text_selections = []
+    for s in view.sel():
+        # Expand empty selections to words
+        if s.empty():
+            r = core.expand_to_word(view, s.begin())
+            # Append the word if it is not empty
+            txt = view.substr(r)
+            if txt != '':
+                logger.debug("Expanded word is valid: '%s'", txt)
+                text_selections.append(core.WordHighlight(txt, match_by_word=True, literal_match=True))
+        # Keep non-empty selections as-is
+        else:
+            text_selections.append(core.WordHighlight(view.substr(s), match_by_word=False, literal_match=True))
+    # Get unique items
+    return list(set(text_selections))
+
+class WordHighlighterHighlightInstancesOfSelectionInWindow(sublime_plugin.TextCommand, core.CollectionableMixin):
+    """
+    Toggles the highlights of the selection in all views of the window, also in the views that are opened later
+    """
+    def run(self, edit):
+        window = self.view.window()
+        if window is None:
+            return
+        self.load_collection()
+        window_set = core.get_window_set(window)
+        for w in get_selection_words(self.view):
+            # The word gets the same color in all views
+            self.collection.choose_color(w)
+            window_set.toggle_word(w)
+        apply_window_set(window)
+
+class WordHighlighterClearWindowInstances(sublime_plugin.WindowCommand):
+    """Clears the highlights that were added to all views of the window"""
+    def run(self):
+        core.get_window_set(self.window).clear()
+        apply_window_set(self.window)
+
+def apply_window_set(window):
+    """
+    Applies the highlight set of the window to all of its views. The views are rescanned on the worker threads,
+    starting with the active view, so that the UI does not freeze even if the window has many views.
+    """
+    window_set = core.get_window_set(window)
+    active_view = window.active_view()
+    views = window.views()
+    views.sort(key=lambda v: active_view is None or v.id() != active_view.id())
+    for view in views:
+        apply_window_set_to_view(view, window_set)
+
+def apply_window_set_to_view(view, window_set):
+    # Views that are still loading get the highlights when they have been loaded
+    if view.is_loading():
+        return
+    collection = core.WordHighlightCollection.load(view)
+    if window_set.apply(collection):
+        worker.worker.submit(worker.ScanJob(collection))
+
 class WordHighlighterEditRegexp(sublime_plugin.TextCommand, core.CollectionableMixin):
     '''
     Edit an existing regexp via an input panel
@@ -199,48 +415,57 @@ class WordHighlighterEditRegexp(sublime_plugin.TextCommand, core.CollectionableM
 
     def _run(self):
         self.load_collection()
-        words = self.collection.words
         # Check if current point is placed on a region
-        sel = self.view.sel()
-        for w in words:
-            word_regions = w.find_all_regions(self.view)
-            for sr in sel:
-                sr = sublime.Region(sr.begin()-1, sr.end()+1)
-                if any([wr.intersects(sr) for wr in word_regions]):
-                    self.edit_regex(w)
+        sel = [sublime.Region(sr.begin()-1, sr.end()+1) for sr in self.view.sel()]
+        hit_words = set(w.get_regex() for hits in self.collection.get_words_at(sel) for w, _ in hits)
+        for w in self.collection.words:
+            if w.get_regex() in hit_words:
+                self.edit_regex(w)
 
     def edit_regex(self, word):
         self.view.window().show_input_panel(self.input_panel_prompt, word.get_regex(), self.create_on_done(word), self.create_on_modified(word), self.create_on_canceled(word))
 
     def create_on_done(self, word):
         def on_done(text):
-            self.set_word_regex(word, text)
-            regions = word.find_all_regions(self.view)
-            highlighted_characters = sum([r.end() - r.begin() for r in regions])
-
-            if highlighted_characters == 0:
-                logger.debug("Removing non-matching regex: {}".format(word.get_regex()))
-                self.collection._remove_word(word)
-                self.collection.update()
-                self.collection.save()
+            core.RegexPreview.stop(self.view)
+            # Confirming a suspended regex without changing it gives it another try
+            if text == word.get_regex():
+                engine.budget.resume(self.view, text)
+            self.collection.set_word_regex(word, text)
+            self.collection.submit_update(functools.partial(self.remove_if_not_matching, word))
+            self.collection.save()
         return on_done
 
+    def remove_if_not_matching(self, word):
+        """Removes the word if the committed update found nothing for it to highlight"""
+        # A suspended regex is kept, so that it can be edited again
+        if not self.collection.has_word(word) or engine.budget.is_suspended(self.view.buffer_id(), word.get_regex()):
+            return
+        found = engine.find_cached_regions(self.view, [word], self.view.change_count())
+        # Progressive and viewport updates do not know the matches of the whole buffer when they are committed
+        if found is None:
+            return
+        highlighted_characters = sum([r.end() - r.begin() for r in found[word.get_regex()]])
+        if highlighted_characters == 0:
+            logger.debug("Removing non-matching regex: %s", word.get_regex())
+            self.collection._remove_word(word)
+            self.collection.submit_update()
+            self.collection.save()
+
     def create_on_modified(self, word):
         def on_modified(text):
-            self.set_word_regex(word, text)
+            # Only previews the regex, the word is changed and saved when the input is done
+            core.RegexPreview(self.collection, word, text).start()
         return on_modified
 
     def create_on_canceled(self, word):
         original_regex = word.get_regex()
         def on_canceled():
-            self.set_word_regex(word, original_regex)
+            core.RegexPreview.stop(self.view)
+            self.collection.set_word_regex(word, original_regex)
+            self.collection.submit_update()
         return on_canceled
 
-    def set_word_regex(self, word, text):
-        word.set_regex(text)
-        self.collection.update()
-        self.collection.save()
-
 class WordHighlighterCreateRegexp(WordHighlighterEditRegexp):
     '''
     Create a regexp via an input panel
@@ -258,8 +483,9 @@ class WordHighlighterCreateRegexp(WordHighlighterEditRegexp):
     def create_on_canceled(self, word):
         def on_canceled():
             logger.debug("Cancelling create regexp")
+            core.RegexPreview.stop(self.view)
             self.collection._remove_word(word)
-            self.collection.update()
+            self.collection.submit_update()
             self.collection.save()
         return on_canceled
 
@@ -270,7 +496,8 @@ class WordHighlighterEditRegexpMenu(WordHighlighterEditRegexp):
     def _run(self, index=0):
         self.load_collection()
         words = self.collection.words
-        word_strings = [w.get_regex() for w in words]
+        buffer_id = self.view.buffer_id()
+        word_strings = [get_word_label(buffer_id, w) for w in words]
         self.view.window().show_quick_panel(word_strings, save_argument_wrapper(self.edit_chosen_word, words), sublime.MONOSPACE_FONT, selected_index=index)
 
     def edit_chosen_word(self, original_words, chosen_index):
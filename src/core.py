@@ -1,8 +1,16 @@
 import sublime
 from . import helpers
+from . import engine
+from . import stats
+from . import worker
+from collections import Counter, OrderedDict
 import copy
+import functools
+import hashlib
+import logging
 import os
 import re
+import time
 
 logger = None
 
@@ -12,6 +20,27 @@ def plugin_loaded():
     logger = helpers.get_logger()
     logger.info("Loading " + __name__)
 
+def plugin_unloaded():
+    serialize_collections()
+
+# The collection of each view by view id, shared by all commands and events. It is only
+# serialized to the view settings when the view is saved or closed, or the plugin is unloaded.
+view_collections = {}
+
+def serialize_collection(view):
+    collection = view_collections.get(view.id())
+    if collection is not None:
+        collection.serialize()
+
+def serialize_collections():
+    for collection in list(view_collections.values()):
+        collection.serialize()
+
+def forget_collection(view):
+    view_collections.pop(view.id(), None)
+    publishers.pop(view.id(), None)
+    match_indexes.pop(view.id(), None)
+
 ## Define some color constants
 class ColorType(object):
     def __init__(self, color_string, name=None, foreground=None, background=None):
@@ -35,26 +64,93 @@ class ColorType(object):
     def __repr__(self):
         return "<{}, {}, {}, {}>".format(self.scope, self.name, self.foreground, self.background)
 
+_color_variable = re.compile(r'var\((.*)\)')
+
 def lookup_color(color_string, variables):
-    r = re.compile(r'var\((.*)\)')
-    m = r.match(color_string.strip())
+    m = _color_variable.match(color_string.strip())
     if not m:
         return color_string
 
     var_name = m.group(1).strip()
     if var_name not in variables:
-        logger.error("The variable {} does not exist among the variables!".format(var_name))
+        logger.error("The variable %s does not exist among the variables!", var_name)
         return color_string
     return variables[var_name]
 
 def get_colors(view):
-    color_scheme = os.path.basename(view.settings().get("color_scheme"))
-    s = sublime.load_settings(color_scheme)
-    variables = s.get("variables")
-    colors = []
-    for rule in s.get("rules"):
-        colors.append(ColorType(rule["scope"], rule["name"], lookup_color(rule["foreground"], variables), lookup_color(rule["background"], variables)))
-    return colors
+    """The highlight colors of the color scheme of the view, only resolved once per color scheme"""
+    return color_scheme_cache.get_palette(view.settings().get("color_scheme"))
+
+class ColorSchemeCache(object):
+    """
+    The generated color schemes of the highlights and the palettes of their colors, shared by all views.
+    Each color scheme gets a generated file with the highlight rules from the template, which Sublime Text
+    merges into it. The files are only written when their contents change, since Sublime Text reloads the
+    color scheme of every view whenever one of them is written.
+    """
+    template = "Packages/word_highlighter/word_highlighter.template-sublime-color-scheme"
+
+    def __init__(self):
+        # The template contents and their hash, only loaded once
+        self.template_contents = None
+        self.template_hash = None
+        # The template hash that the file of each scheme is known to be generated from, by scheme name
+        self.written = {}
+        # The resolved colors of each color scheme, by the file name of the scheme
+        self.palettes = {}
+
+    def get_template(self):
+        if self.template_contents is None:
+            self.template_contents = sublime.load_resource(self.template)
+            self.template_hash = hashlib.sha1(self.template_contents.encode("utf-8")).hexdigest()
+        return self.template_contents
+
+    @staticmethod
+    def get_scheme_path(scheme_name):
+        return os.path.join(helpers.dirs.color_schemes, scheme_name + os.extsep + "sublime-color-scheme")
+
+    def write_scheme(self, color_scheme):
+        """
+        Generates the file with the highlight rules for the color scheme, unless it is up to date
+        @param color_scheme The color_scheme setting of a view
+        @return True if the file was written
+        """
+        scheme_name = os.path.splitext(os.path.basename(color_scheme))[0]
+        contents = self.get_template()
+        if self.written.get(scheme_name) == self.template_hash:
+            return False
+        path = self.get_scheme_path(scheme_name)
+        # The file may already have been generated in an earlier session
+        try:
+            with open(path) as f:
+                is_current = f.read() == contents
+        except OSError:
+            is_current = False
+        if not is_current:
+            logger.info("Adding color scheme %s", color_scheme)
+            with open(path, "w") as f:
+                f.write(contents)
+            self.palettes.pop(os.path.basename(color_scheme), None)
+        self.written[scheme_name] = self.template_hash
+        return not is_current
+
+    def get_palette(self, color_scheme):
+        """The highlight colors of the color scheme, with their variables resolved"""
+        name = os.path.basename(color_scheme)
+        colors = self.palettes.get(name)
+        if colors is None:
+            s = sublime.load_settings(name)
+            variables = s.get("variables")
+            colors = []
+            for rule in s.get("rules"):
+                colors.append(ColorType(rule["scope"], rule["name"], lookup_color(rule["foreground"], variables), lookup_color(rule["background"], variables)))
+            self.palettes[name] = colors
+            # The palette is resolved again if the color scheme is edited
+            s.clear_on_change("word_highlighter.palette")
+            s.add_on_change("word_highlighter.palette", lambda: self.palettes.pop(name, None))
+        return colors
+
+color_scheme_cache = ColorSchemeCache()
 
 # Add some base colors to use for selections (perhaps read from settings file)
 SCOPE_COLORS = ["word_highlighter.color{}".format(i) for i in range(10)]
@@ -67,11 +163,48 @@ def get_color_picking_scheme(name):
         color_picking_scheme = color_schemes[name]
     else:
         color_picking_scheme = color_schemes["RANDOM"]
-        logger.error("Invalid next color scheme setting {}. Choose between {}".format(name, list(color_schemes.keys())))
+        logger.error("Invalid next color scheme setting %s. Choose between %s", name, list(color_schemes.keys()))
     return color_picking_scheme
 
+class ScanResult(object):
+    """The regions found by a scan, to be published in the view"""
+    def __init__(self, state, change_count, windows=None, found=None, progressive=False, viewport=None, index=None):
+        # The words and keys that were scanned for
+        self.state = state
+        # The change count of the buffer that was scanned
+        self.change_count = change_count
+        # The rescanned windows, or None if the whole buffer was scanned
+        self.windows = windows
+        # Dict from regex to Matches, or a list of such dicts for each window
+        self.found = found
+        # Whether the whole buffer should be scanned progressively instead
+        self.progressive = progressive
+        # The window around the visible region that was scanned, if only it is highlighted
+        self.viewport = viewport
+        # The engine.MatchIndex of the words at the change count, or None if the scan could not derive it
+        self.index = index
+
+class ScanSnapshot(object):
+    """
+    The state of a collection that a scan depends on. It is taken on the UI thread, so that the scan can run
+    on a worker thread while the collection is changed.
+    """
+    def __init__(self, collection, words=None):
+        self.words = list(collection.words if words is None else words)
+        # The words and keys that are scanned for
+        self.state = frozenset((w.get_regex(), w.get_key()) for w in self.words)
+        # Whether only the edited regions have to be rescanned, since the same words were published before
+        self.incremental = not collection.removed_words and collection.published == self.state
+        self.published_change_count = collection.published_change_count
+        # The match index that an incremental scan derives the next one from
+        self.index = match_indexes.get(collection.view.id())
+
 # Instances that combine a word with a color scope
 class WordHighlight(object):
+    # Defaults for instances that were pickled before the attributes were added
+    literal = None
+    match_by_word = False
+
     def __init__(self, regex, color=UNSPECIFIED_COLOR, literal_match=False, match_by_word=False):
         assert isinstance(regex, str)
         if isinstance(color, str):
@@ -79,14 +212,24 @@ class WordHighlight(object):
         elif not isinstance(color, ColorType):
             raise ValueError("Invalid color type")
         self.regex = WordHighlight.convert_regex(regex, literal_match=literal_match, match_by_word=match_by_word)
+        self.literal = regex if literal_match else None
+        self.match_by_word = match_by_word
         self.color = color
 
     def get_regex(self):
         return self.regex
 
     def set_regex(self, regex):
+        # A custom regex no longer corresponds to the literal it was created from
+        if regex != self.regex:
+            self.literal = None
+            engine.patterns.invalidate(self.regex)
         self.regex = regex
 
+    # The text the highlight was created from, or None if it is not a literal match
+    def get_literal(self):
+        return self.literal
+
     @staticmethod
     def convert_regex(regex, match_by_word=False, literal_match=False):
         import re
@@ -102,7 +245,7 @@ class WordHighlight(object):
         return regex
 
     def find_all_regions(self, view):
-        return view.find_all(self.get_regex())
+        return engine.find_all_regions(view, [self])[self.get_regex()].to_regions()
 
     def get_key(self):
         return self.color.color_string
@@ -128,44 +271,232 @@ class WordHighlight(object):
 
 class WordHighlightCollection(object):
     """Keeps track of the highlighted words"""
+    # The words and keys that were published by the last full update
+    published = None
+    # The change count of the buffer at the last published update, since when the edits are in the dirty regions
+    published_change_count = None
+    # The regexes of the words that were added by the highlight set of the window
+    window_regexes = frozenset()
 
     def __init__(self, view):
-        self.words = []
+        # The words by regex, in the order they were added
+        self.words_by_regex = OrderedDict()
+        # The number of words of each color
+        self.color_counts = Counter()
         self.view = view
         self.color_index = 0
         self.removed_words = []
 
+    def __setstate__(self, state):
+        # Collections that were pickled before the words were indexed keep them in a list
+        words = state.pop("words", None)
+        self.__dict__.update(state)
+        if words is not None:
+            self.words_by_regex = OrderedDict()
+            self.color_counts = Counter()
+            for w in words:
+                self._index_word(w)
+
+    @property
+    def words(self):
+        return list(self.words_by_regex.values())
+
     def has_word(self, word):
-        return word.get_regex() in [w.get_regex() for w in self.words]
+        return word.get_regex() in self.words_by_regex
 
     def get_word_highlight(self, word):
         assert isinstance(word, WordHighlight)
-        for w in self.words:
-            if w.get_regex() == word.get_regex(): return w
-        return None
+        return self.words_by_regex.get(word.get_regex())
 
-    def update(self):
-        import re
+    def get_published_state(self):
+        return frozenset((w.get_regex(), w.get_key()) for w in self.words)
+
+    def update(self, dirty_regions=None):
+        """
+        Updates the highlighted regions in the view
+        @param dirty_regions The edited regions since the last update. Only the lines around them are
+            rescanned if the words are unchanged since the last update. Rescans everything if None.
+        """
+        self.commit(self.scan(dirty_regions))
+
+    def submit_update(self, on_commit=None):
+        """
+        Updates the highlighted regions on the scan worker, like the updates after edits. The commands use this
+        instead of update, so that a regex that is too slow is suspended by its budget off the UI thread.
+        @param on_commit Called on the UI thread when the update has been committed
+        """
+        worker.worker.submit(worker.ScanJob(self, on_commit=on_commit))
+
+    def snapshot(self, words=None):
+        """The state that a scan depends on. Must be taken on the UI thread."""
+        return ScanSnapshot(self, words)
+
+    def scan(self, dirty_regions=None, cancelled=None, snapshot=None):
+        """
+        Finds the regions of the words without changing any highlights, so that it can run off the UI thread
+        @param dirty_regions See update
+        @param cancelled Function that returns True when the scan is no longer needed
+        @param snapshot ScanSnapshot of the collection, which must be taken on the UI thread if the scan is not
+        @return ScanResult to commit
+        """
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        words = snapshot.words
+        state = snapshot.state
+        regexes = tuple(w.get_regex() for w in words)
+        change_count = self.view.change_count()
+        size = self.view.size()
+        if is_viewport_update(self.view):
+            viewport = get_viewport_window(self.view)
+            found = engine.find_all_regions(self.view, words, viewport, cancelled)
+            index = engine.MatchIndex.build(regexes, found, change_count, size, viewport)
+            return ScanResult(state, change_count, found=found, viewport=viewport, index=index)
+        if dirty_regions is not None and snapshot.incremental:
+            suspended = engine.budget.get_suspended(self.view, words)
+            windows = self.get_dirty_windows(dirty_regions, words)
+            found = [engine.find_all_regions(self.view, words, w, cancelled) for w in windows]
+            # A regex that was suspended while scanning the windows still has its regions in the rest of the buffer
+            if engine.budget.get_suspended(self.view, words) == suspended:
+                index = None
+                if len(windows) == 1:
+                    engine.match_cache.carry_over(self.view, snapshot.published_change_count, change_count, windows[0], found[0])
+                    previous = snapshot.index
+                    if previous is not None and previous.regexes == regexes and previous.change_count == snapshot.published_change_count:
+                        index = previous.splice(windows[0], found[0], change_count, size)
+                return ScanResult(state, change_count, windows=windows, found=found, index=index)
+        # Changes of the colors or the words only regroup the cached matches, without reading the buffer
+        cached = engine.find_cached_regions(self.view, words, change_count)
+        if cached is not None:
+            previous = snapshot.index
+            index = previous if previous is not None and previous.regexes == regexes and previous.change_count == change_count else None
+            return ScanResult(state, change_count, found=cached, index=index)
+
+        settings = helpers.get_settings()
+        if settings.get("progressive_update", True) and self.view.size() > settings.get("progressive_update_size", 1000000):
+            return ScanResult(state, change_count, progressive=True)
+        return ScanResult(state, change_count, found=engine.find_all_regions(self.view, words, cancelled=cancelled))
+
+    def commit(self, result):
+        """
+        Publishes the regions of a scan in the view. Must run on the UI thread.
+        @return False if the words have changed since the scan, so that it could not be published
+        """
+        if result.state != self.get_published_state():
+            return False
+        if result.windows is not None:
+            publish_windows(self.view, self.words, result.windows, result.found, result.change_count)
+            self.published_change_count = result.change_count
+            self.commit_index(result.index)
+            return True
 
-        keys = set((w.get_key() for w in self.removed_words))
-        for key in keys:
-            self.view.erase_regions(key)
+        ProgressiveUpdate.cancel(self.view)
+        publisher = get_publisher(self.view)
+        words = self.words
+        keys = self.get_keys()
+        # Only the keys of removed words that are no longer used by any word are erased
+        changes = {k: (None, None) for k in set((w.get_key() for w in self.removed_words)) - keys}
         self.removed_words.clear()
 
-        keys = set((w.get_key() for w in self.words))
+        if result.progressive:
+            # Keep the highlights of unchanged keys until their chunk has been rescanned
+            published = self.published or frozenset()
+            for k in keys:
+                if set(p for p in published if p[1] == k) != set(p for p in result.state if p[1] == k):
+                    changes[k] = (None, None)
+            publisher.publish(changes)
+            ProgressiveUpdate(self.view, words).start()
+            self.published = result.state
+            self.published_change_count = result.change_count
+            return True
+
+        regions = result.found
+        suspended = engine.budget.get_suspended(self.view, words)
         for k in keys:
-            all_regions = [w.find_all_regions(self.view) for w in self.words if w.get_key() == k]
-            # Create a list of regions from list of lists of regions
-            concatenated_regions = []
-            for r in all_regions:
-                concatenated_regions.extend(r)
-            self.view.add_regions(k, concatenated_regions, k)
+            key_words = [w for w in words if w.get_key() == k]
+            fingerprint = RegionPublisher.get_fingerprint(result.change_count, key_words, result.viewport, suspended)
+            if publisher.is_published(k, fingerprint):
+                continue
+            with stats.timer(self.view, "concatenate"):
+                # Merge the matches of the words, the regions are only created when they are published
+                concatenated_regions = engine.Matches()
+                for w in key_words:
+                    concatenated_regions.extend(regions[w.get_regex()])
+            changes[k] = (concatenated_regions, fingerprint)
+        publisher.publish(changes)
+        publisher.viewport = result.viewport
+        # Only a full update can be the base of an incremental update
+        self.published = result.state if result.viewport is None else None
+        self.published_change_count = result.change_count
+        self.commit_index(result.index)
+        return True
+
+    def commit_index(self, index):
+        """Keeps the match index of a committed scan, or builds it on the scan worker if the scan could not derive it"""
+        if index is not None:
+            self.set_match_index(index)
+        elif self.view.id() not in ProgressiveUpdate.running:
+            # A progressive update builds it when it is done
+            self.submit_index()
+
+    def submit_index(self):
+        worker.worker.submit(worker.IndexJob(self))
+
+    def set_match_index(self, index):
+        match_indexes[self.view.id()] = index
+
+    def get_words_at(self, regions):
+        """
+        Finds the words with a match that overlaps each of the regions, by bisecting into the match index
+        @return A list of (word, matched region) for each region, in the order of the words. The lists are
+            empty while the match index is still being built.
+        """
+        index = self.get_match_index()
+        if index is None:
+            sublime.status_message("Word Highlighter: the highlights are still being updated")
+            return [[] for r in regions]
+        return [[(self.words_by_regex[regex], m) for regex, m in index.regexes_at(r.begin(), r.end())] for r in regions]
+
+    def get_match_index(self):
+        """
+        The matches of the words merged into one engine.MatchIndex, or None while it is still being built.
+        The committed updates derive it from the previous index where they can, and otherwise build it on the
+        scan worker, so it is never built on the UI thread. Updates by viewport only index the viewport window.
+        """
+        index = match_indexes.get(self.view.id())
+        if index is None or index.change_count != self.view.change_count() or index.regexes != tuple(self.words_by_regex):
+            return None
+        return index
+
+    def get_dirty_windows(self, dirty_regions, words=None):
+        """
+        Expands the dirty regions to the lines around them, so that no highlight crosses their borders
+        @param words The words whose highlights are kept whole, if not all words of the collection
+        """
+        margin_lines = helpers.get_settings().get("incremental_margin_lines", 3)
+        keys = self.get_keys() if words is None else set(w.get_key() for w in words)
+        # Sublime Text keeps the published regions in place when the text is edited
+        published = [self.view.get_regions(k) for k in keys]
+        windows = engine.merge_regions([engine.expand_to_lines(self.view, r, margin_lines) for r in dirty_regions])
+        for _ in range(3):
+            widened = []
+            for w in windows:
+                for regions in published:
+                    start, stop = engine.intersecting_slice(regions, w)
+                    for r in regions[start:stop]:
+                        w = w.cover(r)
+                widened.append(engine.expand_to_lines(self.view, w))
+            widened = engine.merge_regions(widened)
+            if widened == windows:
+                break
+            windows = widened
+        logger.debug("Rescanning %d dirty windows: %s", len(windows), windows)
+        return windows
+
+    def get_keys(self):
+        """The keys of the regions of the words"""
+        return set(k for k, count in self.color_counts.items() if count > 0)
 
     def color_frequencies(self):
-        freqs = [0]*len(SCOPE_COLORS)
-        for i, c in enumerate(SCOPE_COLORS):
-            freqs[i] = len([1 for w in self.words if (w.color == c)])
-        return freqs
+        return [self.color_counts[c] for c in SCOPE_COLORS]
 
     def next_color_index(self):
         self.color_index = (self.color_index + 1) % len(SCOPE_COLORS)
@@ -179,15 +510,16 @@ class WordHighlightCollection(object):
             min_ind = min((v,ind) for ind,v in enumerate(self.color_frequencies()))[1]
             next_color = ColorType(SCOPE_COLORS[min_ind])
         elif color_picking_scheme is get_color_picking_scheme("CYCLIC_EVEN"):
-            min_frequency = min((v,ind) for ind,v in enumerate(self.color_frequencies()))[0]
             freqs = self.color_frequencies()
+            min_frequency = min(freqs)
             while freqs[self.color_index] != min_frequency:
                 self.next_color_index()
             next_color = ColorType(SCOPE_COLORS[self.color_index])
             self.next_color_index()
         elif color_picking_scheme is get_color_picking_scheme("RANDOM_EVEN"):
-            min_frequency = min((v,ind) for ind,v in enumerate(self.color_frequencies()))[0]
-            min_frequency_indices = [ind for ind,f in enumerate(self.color_frequencies()) if f == min_frequency]
+            freqs = self.color_frequencies()
+            min_frequency = min(freqs)
+            min_frequency_indices = [ind for ind,f in enumerate(freqs) if f == min_frequency]
             next_color = ColorType(SCOPE_COLORS[random.choice(min_frequency_indices)])
         elif color_picking_scheme is get_color_picking_scheme("CYCLIC"):
             next_color = ColorType(SCOPE_COLORS[self.color_index])
@@ -204,61 +536,510 @@ class WordHighlightCollection(object):
             self._remove_word(word)
         else:
             self._add_word(word)
-        logger.debug("Used words: {}".format([str(w) for w in self.words]))
+        logger.debug("Toggled word %s, %d words used", word, len(self.words_by_regex))
 
     def _add_word(self, word):
         assert isinstance(word, WordHighlight)
+        self.choose_color(word)
+        self._index_word(word)
+
+    def choose_color(self, word):
+        """Gives the word the next color of the color picking scheme, unless it already has a color"""
         if word.color is UNSPECIFIED_COLOR:
             settings = helpers.get_settings()
             color_picking_scheme = get_color_picking_scheme(settings.get("color_picking_scheme"))
-            logger.debug("Chosen color scheme: {}".format(color_picking_scheme))
+            logger.debug("Chosen color scheme: %s", color_picking_scheme)
             word.set_color(self.get_next_word_color(color_picking_scheme))
-        self.words.append(word)
+
+    def _index_word(self, word):
+        previous = self.words_by_regex.get(word.get_regex())
+        if previous is not None:
+            self.color_counts[previous.get_key()] -= 1
+        self.words_by_regex[word.get_regex()] = word
+        self.color_counts[word.get_key()] += 1
 
     def _remove_word(self, word):
         assert isinstance(word, WordHighlight)
-        if self.has_word(word):
-            w = self.get_word_highlight(word)
-            self.words.remove(w)
+        w = self.words_by_regex.pop(word.get_regex(), None)
+        if w is not None:
+            self.color_counts[w.get_key()] -= 1
             self.removed_words.append(copy.deepcopy(w))
 
+    def set_word_regex(self, word, regex):
+        """
+        Changes the regex of a word in the collection, keeping its place among the words.
+        If another word already has the regex, the word replaces it, so that no two words share a regex.
+        """
+        old_regex = word.get_regex()
+        if self.words_by_regex.get(old_regex) is not word:
+            old_regex = next((r for r, w in self.words_by_regex.items() if w is word), None)
+        word.set_regex(regex)
+        if old_regex is None or old_regex == regex:
+            return
+        other = self.words_by_regex.get(regex)
+        if other is not None:
+            self._remove_word(other)
+        self.words_by_regex = OrderedDict((regex if r == old_regex else r, w) for r, w in self.words_by_regex.items())
+
     def clear(self):
         logger.debug("Clearing all highlighted words")
-        self.words.clear()
+        ProgressiveUpdate.cancel(self.view)
+        self.words_by_regex.clear()
+        self.color_counts.clear()
         self.removed_words.clear()
-        for k in SCOPE_COLORS:
-            self.view.erase_regions(k)
+        get_publisher(self.view).publish({k: (None, None) for k in SCOPE_COLORS})
 
     @classmethod
     def load(cls, view):
+        with stats.timer(view, "load"):
+            instance = view_collections.get(view.id())
+            if instance is None:
+                instance = cls.deserialize(view)
+                view_collections[view.id()] = instance
+        return instance
+
+    def save(self):
+        view_collections[self.view.id()] = self
+
+    @classmethod
+    def deserialize(cls, view):
         import pickle
         collection_stream = view.settings().get("Wordhighlighter_collection")
         instance = pickle.loads(bytes(collection_stream))
         assert isinstance(instance, cls)
+        # The settings may have been copied from another view, e.g. when cloning it
+        instance.view = view
         return instance
 
-    def save(self):
+    def serialize(self):
         import pickle
-        collection_stream = pickle.dumps(self)
-        self.view.settings().set("Wordhighlighter_collection", collection_stream)
+        with stats.timer(self.view, "save"):
+            collection_stream = pickle.dumps(self)
+            self.view.settings().set("Wordhighlighter_collection", collection_stream)
 
     @classmethod
     def restore(cls, view):
+        """
+        Recreates the words from the highlighted regions in the view. The regions are grouped by their text,
+        read from a single snapshot of the buffer, and each distinct text is only classified once.
+        """
         collection = cls(view)
+        text = None
         for s in SCOPE_COLORS:
             regions = view.get_regions(s)
-            unique_words = set()
-            if len(regions):
-                for r in regions:
-                    word = view.substr(r)
-                    whole_word = view.substr(expand_to_word(view, r.begin()))
-                    matches_whole_word = (word == whole_word)
-                    unique_words |= set(((word, matches_whole_word), ))
-            for w in unique_words:
-                logger.info("Restoring word: '{}'".format(w[0]))
-                collection._add_word(WordHighlight(w[0], color=s, match_by_word=w[1]))
+            if not len(regions):
+                continue
+            if text is None:
+                text = engine.get_snapshot(view)
+            # The first region of each distinct text, in the order they appear
+            first_regions = OrderedDict()
+            for r in regions:
+                first_regions.setdefault(text[r.begin():r.end()], r)
+            for word, r in first_regions.items():
+                matches_whole_word = (word == view.substr(expand_to_word(view, r.begin())))
+                logger.info("Restoring word: '%s'", word)
+                collection._add_word(WordHighlight(word, color=s, match_by_word=matches_whole_word))
         return collection
 
+# The highlight set of each window by window id
+window_sets = {}
+
+def get_window_set(window):
+    window_set = window_sets.get(window.id())
+    if window_set is None:
+        window_set = window_sets[window.id()] = WindowHighlightSet()
+    return window_set
+
+class WindowHighlightSet(object):
+    """The words that are highlighted in every view of a window, including the views that are opened later"""
+    def __init__(self):
+        self.words_by_regex = OrderedDict()
+
+    @property
+    def words(self):
+        return list(self.words_by_regex.values())
+
+    def toggle_word(self, word):
+        """Adds a copy of the word to the set, or removes it if it is already in the set"""
+        if self.words_by_regex.pop(word.get_regex(), None) is None:
+            self.words_by_regex[word.get_regex()] = copy.deepcopy(word)
+        logger.debug("Toggled word %s in window set, %d words used", word, len(self.words_by_regex))
+
+    def clear(self):
+        self.words_by_regex.clear()
+
+    def apply(self, collection):
+        """
+        Adds the words of the set to the collection, and removes the words that the set added but no longer has.
+        Words that were already highlighted in the view are left as they are.
+        @return Whether the collection changed
+        """
+        changed = False
+        window_regexes = set()
+        for regex in collection.window_regexes:
+            word = collection.words_by_regex.get(regex)
+            if word is None:
+                continue
+            if regex in self.words_by_regex:
+                window_regexes.add(regex)
+            else:
+                collection._remove_word(word)
+                changed = True
+        for regex, word in self.words_by_regex.items():
+            if not collection.has_word(word):
+                collection._add_word(copy.deepcopy(word))
+                window_regexes.add(regex)
+                changed = True
+        collection.window_regexes = frozenset(window_regexes)
+        return changed
+
+def is_viewport_update(view):
+    """Whether only the matches around the visible region are highlighted, since the buffer is too large to highlight all of them"""
+    settings = helpers.get_settings()
+    return settings.get("viewport_update", True) and view.size() > settings.get("viewport_update_size", 20000000)
+
+def get_viewport_window(view, margin_lines=None):
+    """The whole lines of the visible region, with margin_lines extra lines above and below"""
+    if margin_lines is None:
+        margin_lines = helpers.get_settings().get("viewport_margin_lines", 200)
+    return engine.expand_to_lines(view, view.visible_region(), margin_lines)
+
+# The publisher of each view, by view id
+publishers = {}
+
+# The engine.MatchIndex of the words of each view, by view id
+match_indexes = {}
+
+def get_publisher(view):
+    publisher = publishers.get(view.id())
+    if publisher is None:
+        publisher = publishers[view.id()] = RegionPublisher(view)
+    return publisher
+
+class RegionPublisher(object):
+    """
+    Publishes the regions of each key in a view, skipping the keys whose regions have not changed.
+    The regions of a key only depend on the text and on the regexes of its words, so the change count
+    of the scanned buffer and the regexes make up a fingerprint of the regions that were published.
+    The regexes that are suspended by the budget of the engine have no regions, so they are left out of it.
+    """
+    def __init__(self, view):
+        self.view = view
+        # The fingerprint of the published regions by key, or None if they are only partially published
+        self.fingerprints = {}
+        # The window that the published regions are limited to, or None if they cover the whole buffer
+        self.viewport = None
+
+    @staticmethod
+    def get_fingerprint(change_count, key_words, viewport=None, suspended=frozenset()):
+        """@param suspended The regexes that are suspended by the budget of the engine"""
+        viewport = None if viewport is None else (viewport.begin(), viewport.end())
+        regexes = frozenset(w.get_regex() for w in key_words if w.get_regex() not in suspended)
+        return (change_count, regexes, viewport)
+
+    def is_viewport_covered(self):
+        """Whether the published window still covers the visible region with at least half of the margin"""
+        if self.viewport is None:
+            return True
+        margin_lines = helpers.get_settings().get("viewport_margin_lines", 200) // 2
+        return self.viewport.contains(get_viewport_window(self.view, margin_lines))
+
+    def is_published(self, key, fingerprint):
+        return fingerprint is not None and self.fingerprints.get(key) == fingerprint
+
+    def publish(self, changes):
+        """
+        Applies the changed keys together. Must run on the UI thread.
+        @param changes dict from key to (regions, fingerprint), where the key is erased if regions is None.
+            The regions are a list of regions or Matches.
+        """
+        for key, (regions, fingerprint) in changes.items():
+            if regions is None:
+                with stats.timer(self.view, "erase_regions"):
+                    self.view.erase_regions(key)
+            else:
+                if isinstance(regions, engine.Matches):
+                    regions = regions.to_regions()
+                with stats.timer(self.view, "add_regions"):
+                    self.view.add_regions(key, regions, key)
+            self.fingerprints[key] = fingerprint
+        if changes:
+            logger.debug("Published keys %s", list(changes.keys()))
+
+def publish_windows(view, words, windows, found, change_count, complete=True):
+    """
+    Replaces the highlighted regions within the windows by the regions that were found there.
+    Keys whose regions are the same in all windows are left as they are.
+    @param windows Sorted list of disjoint windows
+    @param found List with a dict from regex to Matches for each of the windows
+    @param complete Whether the regions of each key are complete afterwards, if they were before
+    """
+    publisher = get_publisher(view)
+    changes = {}
+    suspended = engine.budget.get_suspended(view, words)
+    for k in set((w.get_key() for w in words)):
+        key_words = [w for w in words if w.get_key() == k]
+        found_regions = []
+        for f in found:
+            window_regions = [r for w in key_words for r in f[w.get_regex()]]
+            # Sorted like the regions in the view, so that unchanged windows can be recognized
+            window_regions.sort(key=lambda r: (r.begin(), r.end()))
+            found_regions.append(window_regions)
+        fingerprint = RegionPublisher.get_fingerprint(change_count, key_words, suspended=suspended)
+        previous = publisher.fingerprints.get(k)
+        if not complete or previous is None or previous[1] != fingerprint[1] or previous[2] is not None:
+            fingerprint = None
+        regions = view.get_regions(k)
+        if engine.is_spliced(regions, windows, found_regions):
+            publisher.fingerprints[k] = fingerprint
+        else:
+            changes[k] = (engine.splice_regions(regions, windows, found_regions), fingerprint)
+    publisher.publish(changes)
+
+class ProgressiveUpdate(object):
+    """
+    Highlights the visible region first, and then the rest of the buffer in time-boxed chunks on the async thread.
+    The chunks that are left to scan are stored as hidden regions, so that Sublime Text moves them along with edits.
+    When the buffer was not edited during the update, the matches of the chunks are cached as the matches of the
+    whole buffer, so that later changes of the colors or the words do not have to scan it again.
+    """
+    key = "word_highlighter.pending"
+    # The running update of each view, by view id
+    running = {}
+
+    def __init__(self, view, words):
+        self.view = view
+        self.words = list(words)
+        self.cancelled = False
+        self.change_count = view.change_count()
+        self.suspended = engine.budget.get_suspended(view, self.words)
+        # Scanned chunks and their found regions, that have not been published yet
+        self.unpublished = []
+        self.last_publish = 0
+        # Published chunks and their found regions, as long as the buffer has not been edited during the update
+        self.published_found = []
+        self.consistent = True
+
+    @classmethod
+    def cancel(cls, view):
+        update = cls.running.pop(view.id(), None)
+        if update is not None:
+            update.cancelled = True
+            view.erase_regions(cls.key)
+
+    def start(self):
+        ProgressiveUpdate.cancel(self.view)
+        ProgressiveUpdate.running[self.view.id()] = self
+        chunk_size = helpers.get_settings().get("progressive_chunk_size", 100000)
+        self.view.add_regions(self.key, self.split_into_chunks(chunk_size), "", "", sublime.HIDDEN)
+        self.step(on_ui_thread=True)
+
+    def split_into_chunks(self, chunk_size):
+        """Splits the buffer into chunks of whole lines"""
+        chunks = []
+        begin = 0
+        size = self.view.size()
+        while begin < size:
+            end = self.view.line(min(begin + chunk_size, size)).end()
+            chunks.append(sublime.Region(begin, end))
+            begin = end + 1
+        return chunks
+
+    def scan_chunk(self, chunk, margin_lines):
+        """Finds the regions that begin within the chunk (or on its trailing newline)"""
+        window = engine.expand_to_lines(self.view, chunk, margin_lines)
+        found = engine.find_all_regions(self.view, self.words, window)
+        window_regions = {}
+        for regex, matches in found.items():
+            window_regions[regex] = matches.beginning_within(chunk.begin(), chunk.end())
+        return window_regions
+
+    def step(self, on_ui_thread=False):
+        if self.cancelled:
+            return
+        settings = helpers.get_settings()
+        margin_lines = settings.get("incremental_margin_lines", 3)
+        deadline = time.perf_counter() + settings.get("progressive_time_box", 0.05)
+        # Scanned chunks stay pending until they are published, so that they are moved along with edits
+        if self.view.change_count() != self.change_count:
+            self.unpublished = []
+            self.change_count = self.view.change_count()
+            # The published chunks have moved with the edits, but their found regions have not
+            self.consistent = False
+        scanned_chunks = [s[0] for s in self.unpublished]
+        pending = [c for c in self.view.get_regions(self.key) if c not in scanned_chunks]
+        # Chunks in the visible region go first, which also puts them first after scrolling
+        visible = self.view.visible_region()
+        scanned_visible = False
+        scanned = False
+        while pending and (not scanned or time.perf_counter() < deadline):
+            index = next((i for i, c in enumerate(pending) if c.intersects(visible)), 0)
+            chunk = pending.pop(index)
+            scanned_visible |= chunk.intersects(visible)
+            scanned = True
+            self.unpublished.append((chunk, self.scan_chunk(chunk, margin_lines)))
+        # A regex that was suspended during the update still has its regions in the chunks that were published
+        if engine.budget.get_suspended(self.view, self.words) != self.suspended:
+            sublime.set_timeout(ProgressiveUpdate(self.view, self.words).start, 0)
+            return
+
+        # Publishing rewrites all regions of a key, so only do it once in a while unless it can be seen
+        if scanned_visible or not pending or time.perf_counter() - self.last_publish > settings.get("progressive_publish_interval", 0.5):
+            if on_ui_thread:
+                self.publish(pending)
+            else:
+                sublime.set_timeout(functools.partial(self.publish, pending), 0)
+        else:
+            sublime.set_timeout_async(self.step, 0)
+
+    def publish(self, pending):
+        """Publishes the scanned chunks together on the UI thread, and then continues with the next step"""
+        if self.cancelled:
+            return
+        # The chunks are scanned again if the buffer has changed, since they are still pending in the view
+        if self.view.change_count() == self.change_count:
+            self.unpublished.sort(key=lambda s: s[0].begin())
+            publish_windows(self.view, self.words, [s[0] for s in self.unpublished], [s[1] for s in self.unpublished], self.change_count, complete=False)
+            self.view.add_regions(self.key, pending, "", "", sublime.HIDDEN)
+            self.published_found.extend(self.unpublished)
+        self.unpublished = []
+        self.last_publish = time.perf_counter()
+        if self.view.get_regions(self.key):
+            sublime.set_timeout_async(self.step, 0)
+        else:
+            logger.debug("Progressive update done")
+            ProgressiveUpdate.cancel(self.view)
+            self.cache_whole_buffer()
+            collection = view_collections.get(self.view.id())
+            if collection is not None:
+                collection.submit_index()
+
+    def cache_whole_buffer(self):
+        """Caches the found regions of the chunks as the matches of the whole buffer, unless it has been edited since the update started"""
+        if not self.consistent or self.view.change_count() != self.change_count:
+            return
+        buffer_id = self.view.buffer_id()
+        size = self.view.size()
+        self.published_found.sort(key=lambda s: s[0].begin())
+        for w in self.words:
+            # The empty regions of a suspended regex are not its real matches
+            if w.get_regex() in self.suspended:
+                continue
+            matches = engine.Matches()
+            for _, found in self.published_found:
+                matches.extend(found[w.get_regex()])
+            engine.match_cache.put(buffer_id, self.change_count, size, w.get_regex(), None, matches)
+        self.published_found = []
+
+class RegexPreview(object):
+    """
+    Shows the matches of a regex while it is being edited, without changing the collection.
+    The regex is compiled and scanned as a job of the scan worker, the visible region first and then the rest of the
+    buffer in chunks. The scan stops when a newer preview replaces it, or when it has used up its time or match
+    budget, so that partial regexes like .* do not keep the editor busy.
+    """
+    key = "word_highlighter.preview"
+    # The running preview of each view, by view id
+    running = {}
+
+    def __init__(self, collection, word, regex):
+        self.view = collection.view
+        self.collection = collection
+        self.word = word
+        self.regex = regex
+        self.cancelled = False
+        self.change_count = self.view.change_count()
+        self.buffer_id = self.view.buffer_id()
+        # The previews of a view replace each other in the worker, but not the scans of the view
+        self.job_key = ("preview", self.view.id())
+
+    @classmethod
+    def stop(cls, view):
+        """Cancels the preview of the view and erases its regions. Must run on the UI thread."""
+        preview = cls.running.pop(view.id(), None)
+        if preview is not None:
+            worker.worker.cancel(preview.job_key)
+        view.erase_regions(cls.key)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled or self.view.change_count() != self.change_count
+
+    def start(self):
+        """Replaces the running preview of the view. Must run on the UI thread."""
+        if self.view.id() not in RegexPreview.running:
+            self.hide_word()
+        RegexPreview.running[self.view.id()] = self
+        # The worker cancels the previous preview
+        worker.worker.submit(self)
+
+    def hide_word(self):
+        """Publishes the key of the word without the word while it is previewed, from the cached matches of the others"""
+        key = self.word.get_key()
+        others = [w for w in self.collection.words if w.get_key() == key and w is not self.word]
+        publisher = get_publisher(self.view)
+        found = engine.find_all_regions(self.view, others, publisher.viewport)
+        regions = engine.Matches()
+        for w in others:
+            regions.extend(found[w.get_regex()])
+        # Without a fingerprint, the next update publishes the key again
+        publisher.publish({key: (regions, None)})
+
+    def get_chunks(self, chunk_size):
+        """The visible lines first, and then the rest of the buffer in chunks of whole lines"""
+        visible = engine.expand_to_lines(self.view, self.view.visible_region())
+        yield visible
+        for begin, end in ((0, visible.begin() - 1), (visible.end() + 1, self.view.size())):
+            while begin <= end:
+                chunk_end = min(self.view.line(min(begin + chunk_size, end)).end(), end)
+                yield sublime.Region(begin, chunk_end)
+                begin = chunk_end + 1
+
+    def run(self):
+        # Invalid regexes are rejected before scanning, but Sublime Text finds those that only Python does not understand
+        foreign = bool(self.regex) and engine.has_foreign_syntax(self.regex)
+        if not self.regex or (engine.patterns.get(self.regex) is None and not foreign):
+            sublime.set_timeout(functools.partial(self.publish, engine.Matches(), "invalid regex" if self.regex else None), 0)
+            return
+        settings = helpers.get_settings()
+        deadline = time.perf_counter() + settings.get("preview_time_budget", 1.0)
+        max_matches = settings.get("preview_max_matches", 10000)
+        margin_lines = settings.get("incremental_margin_lines", 3)
+        word = WordHighlight(self.regex)
+        found = engine.Matches()
+        message = None
+        try:
+            # Sublime Text always searches the whole buffer, so it is done at once
+            chunks = [sublime.Region(0, self.view.size())] if foreign else self.get_chunks(settings.get("progressive_chunk_size", 100000))
+            for index, chunk in enumerate(chunks):
+                window = engine.expand_to_lines(self.view, chunk, margin_lines)
+                matches = engine.scan_regions(self.view, [word], window, self.is_cancelled)[self.regex]
+                found.extend(matches.beginning_within(chunk.begin(), chunk.end()))
+                if engine.budget.is_suspended(self.buffer_id, self.regex):
+                    message = "regex is too slow, it is suspended"
+                    break
+                if len(found) >= max_matches or time.perf_counter() > deadline:
+                    del found.begins[max_matches:]
+                    del found.ends[max_matches:]
+                    message = "preview stopped after {} matches".format(len(found))
+                    break
+                # The visible region is shown before the rest has been scanned
+                if index == 0:
+                    sublime.set_timeout(functools.partial(self.publish, engine.Matches(found.begins[:], found.ends[:])), 0)
+        except engine.ScanCancelled:
+            return
+        sublime.set_timeout(functools.partial(self.publish, found, message), 0)
+
+    def publish(self, found, message=None):
+        if self.is_cancelled():
+            return
+        regions = sorted(found.to_regions(), key=lambda r: (r.begin(), r.end()))
+        self.view.add_regions(self.key, regions, self.word.get_scope())
+        if message is not None:
+            sublime.status_message("Word Highlighter: {}".format(message))
+
 # Expand the point to a region that contains a word, or an empty Region if
 # the point is not placed at a word.
 def expand_to_word(view, point):
@@ -288,9 +1069,54 @@ def expand_to_word(view, point):
             # Valid word!
             return r
         else:
-            logger.debug("Expanded word is invalid: '{}'".format(view.substr(r)))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Expanded word is invalid: '%s'", view.substr(r))
             return sublime.Region(point, point) # Empty region
 
+# Text commands that only edit the text right before the cursors
+LOCAL_EDIT_COMMANDS = {"insert", "insert_snippet", "paste", "left_delete", "right_delete", "delete_word", "insert_completion", "insert_best_completion", "commit_completion"}
+
+class DirtyRegions(object):
+    """
+    Keeps track of the regions that have been edited since the last update.
+    They are stored as hidden regions in the view, so that Sublime Text moves them along with later edits.
+    """
+    key = "word_highlighter.dirty"
+
+    def __init__(self, view):
+        self.view = view
+        self.everything = False
+
+    def add(self, regions):
+        regions = self.view.get_regions(self.key) + list(regions)
+        self.view.add_regions(self.key, regions, "", "", sublime.HIDDEN)
+
+    def add_everything(self):
+        self.everything = True
+
+    def add_edit(self, command, args, size_delta):
+        """Marks the text around the cursors as dirty after a text command, or everything if the edit can be anywhere"""
+        if command not in LOCAL_EDIT_COMMANDS or not helpers.get_settings().get("incremental_update", True):
+            self.add_everything()
+            return
+        args = args or {}
+        inserted_text = {"insert": args.get("characters", ""), "insert_snippet": args.get("contents", "")}.get(command, "")
+        if command == "paste":
+            inserted_text = sublime.get_clipboard()
+        # The inserted text contains the cursor, but it does not always end there: snippets, auto-paired
+        # brackets and some pastes leave the cursor before the end, so both sides of the cursor are dirty
+        inserted_length = max(len(inserted_text), size_delta, 0)
+        size = self.view.size()
+        self.add(sublime.Region(max(0, s.begin() - inserted_length), min(size, s.end() + inserted_length)) for s in self.view.sel())
+
+    def get(self):
+        """Returns the dirty regions, or None if everything is dirty"""
+        return None if self.everything else self.view.get_regions(self.key)
+
+    def clear(self):
+        self.view.erase_regions(self.key)
+        self.everything = False
+
 class CollectionableMixin(object):
     def load_collection(self):
         self.collection = WordHighlightCollection.load(self.view)
@@ -0,0 +1,740 @@
+import sublime
+from . import helpers
+from . import stats
+from array import array
+import bisect
+import collections
+import functools
+import re
+import threading
+import time
+
+logger = None
+
+def plugin_loaded():
+    global logger
+    helpers.plugin_loaded()
+    logger = helpers.get_logger()
+    logger.info("Loading " + __name__)
+
+# Flags that make Python's re module interpret a pattern like Sublime Text's find_all does
+REGEX_FLAGS = re.MULTILINE
+_word_characters = re.compile(r'\w+\Z')
+
+def is_combinable(word):
+    """
+    Whether the word can be found in a combined scan together with other words.
+    Whole-word literals made up of word characters can never overlap each other, so
+    they give exactly the same matches in a combined scan as when scanned one by one.
+    """
+    literal = word.get_literal()
+    return literal is not None and word.match_by_word and _word_characters.match(literal) is not None
+
+def is_plain_literal(word):
+    """Whether the word is a literal that is not bounded by words, like the highlights of non-empty selections"""
+    return bool(word.get_literal()) and not word.match_by_word
+
+def build_trie(literals):
+    """Builds a trie of nested dicts by character, where the key '' holds the literal that ends at a node"""
+    trie = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(c, {})
+        node[''] = literal
+    return trie
+
+def trie_to_regex(trie):
+    """Creates a regex alternation of the literals in the trie, with common prefixes merged"""
+    def build(node):
+        alternatives = [re.escape(c) + build(child) for c, child in sorted(node.items()) if c != '']
+        if not alternatives:
+            return ''
+        regex = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            regex = '(?:' + regex + ')?'
+        return regex
+    return build(trie)
+
+def literals_to_regex(literals):
+    return trie_to_regex(build_trie(literals))
+
+# Syntax of the regex engines of Sublime Text that Python's re compiles without an error, but with another
+# meaning: escapes that Python takes as the plain letter (\h, \z, \p{L}, ...), POSIX classes like [[:alpha:]],
+# and inline flags after the start of the pattern, which Python applies to the whole pattern. Other escapes
+# are skipped as a whole, so that an escaped backslash is not taken as the start of an escape.
+_foreign_syntax = re.compile(r'(?P<escape>\\(?:x\{|[hHzpPRXKGQEeoN]))|\\.|(?P<posix>\[:[a-z]+:\])|(?P<flags>\(\?[aiLmsux]+\))', re.DOTALL)
+
+def has_foreign_syntax(regex):
+    """Whether Python's re would compile the regex, but not match the same text as Sublime Text"""
+    for m in _foreign_syntax.finditer(regex):
+        if m.lastgroup is not None and (m.lastgroup != "flags" or m.start() > 0):
+            return True
+    return False
+
+class PatternCache(object):
+    """Least recently used cache of compiled patterns, keyed by regex and flags"""
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.patterns = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, regex, flags=REGEX_FLAGS):
+        """Returns the compiled pattern, or None if it is not a pattern that Python understands like Sublime Text"""
+        key = (regex, flags)
+        with self.lock:
+            if key in self.patterns:
+                self.patterns.move_to_end(key)
+                return self.patterns[key]
+        try:
+            pattern = None if has_foreign_syntax(regex) else re.compile(regex, flags)
+        except (re.error, OverflowError, RuntimeError):
+            pattern = None
+        with self.lock:
+            self.patterns[key] = pattern
+            while len(self.patterns) > self.max_size:
+                self.patterns.popitem(last=False)
+        return pattern
+
+    def invalidate(self, regex):
+        with self.lock:
+            for key in [k for k in self.patterns if k[0] == regex]:
+                del self.patterns[key]
+
+patterns = PatternCache()
+
+# The latest snapshot of the text of each buffer, as (change count, text) by buffer id.
+# All views of the same file share the buffer, so its text only has to be read once per change.
+_snapshots = {}
+
+def get_snapshot(view):
+    """Returns the text of the whole buffer, only reading it from the view once per change count"""
+    text = get_cached_snapshot(view)
+    if text is None:
+        change_count = view.change_count()
+        text = view.substr(sublime.Region(0, view.size()))
+        # The buffer may have changed while it was read
+        if view.change_count() == change_count:
+            _snapshots[view.buffer_id()] = (change_count, text)
+    return text
+
+def get_cached_snapshot(view):
+    """Returns the text of the whole buffer if it has already been read at the current change count, otherwise None"""
+    snapshot = _snapshots.get(view.buffer_id())
+    if snapshot is None or snapshot[0] != view.change_count():
+        return None
+    return snapshot[1]
+
+def forget_snapshot(view):
+    forget_buffer(view.buffer_id())
+
+def forget_buffer(buffer_id):
+    """Forgets the text, the cached matches and the suspended regexes of a buffer"""
+    _snapshots.pop(buffer_id, None)
+    match_cache.forget(buffer_id)
+    budget.forget(buffer_id)
+
+def forget_closed_buffer(view, buffer_id):
+    """
+    Forgets the state of the buffer of a view that has been closed, unless the buffer is still open in another view
+    @param buffer_id The buffer id of the view, which can no longer be read from a closed view
+    """
+    for window in sublime.windows():
+        for other in window.views():
+            if other.id() != view.id() and other.buffer_id() == buffer_id:
+                return
+    forget_buffer(buffer_id)
+
+class BufferMatches(object):
+    """
+    The cached matches in one version of the text of a buffer.
+    When all edits since the previous version lie within a single window that has been scanned again, the
+    matches of the whole buffer are derived from the previous version when they are first needed: the window
+    is replaced by its new matches, and the matches after it are moved by the change in size.
+    """
+    # Maximum number of versions that the matches are derived through, before they have to be scanned again
+    max_depth = 32
+
+    def __init__(self, change_count, size, previous=None, max_windows=4096):
+        self.change_count = change_count
+        self.size = size
+        # Matches of the whole buffer by regex
+        self.whole = {}
+        # Matches within windows by (regex, (begin, end)), the least recently used first
+        self.windows = collections.OrderedDict()
+        self.max_windows = max_windows
+        self.previous = previous
+        # (begin, old end, change in size, dict from regex to Matches) of the window that was edited since the
+        # previous version, or None if the matches cannot be derived from it
+        self.splice = None
+        self.depth = 0
+
+    def get_whole(self, regex):
+        """The matches of the regex in the whole buffer, or None if they are neither cached nor derivable"""
+        versions = []
+        version = self
+        while regex not in version.whole:
+            if version.splice is None or regex not in version.splice[3]:
+                return None
+            versions.append(version)
+            version = version.previous
+        found = version.whole[regex]
+        if versions:
+            for v in reversed(versions):
+                begin, old_end, delta, window_found = v.splice
+                found = splice_matches(found, begin, old_end, delta, window_found[regex])
+            # The older version is only kept to derive the matches of newer versions from
+            del version.whole[regex]
+            self.whole[regex] = found
+        return found
+
+    def get_window(self, regex, window):
+        found = self.windows.get((regex, window))
+        if found is not None:
+            self.windows.move_to_end((regex, window))
+            return found
+        # Deriving the matches of the whole buffer is not worth it for a window
+        whole = self.whole.get(regex)
+        if whole is None:
+            return None
+        return whole.within(*window)
+
+    def put(self, regex, window, found):
+        if window is None:
+            self.whole[regex] = found
+            return
+        self.windows[(regex, window)] = found
+        while len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+
+def splice_matches(matches, begin, old_end, delta, window_matches):
+    """Replaces the sorted matches that begin between begin and old_end, and moves the matches after them by delta"""
+    head = bisect.bisect_left(matches.begins, begin)
+    tail = bisect.bisect_right(matches.begins, old_end)
+    spliced = Matches(matches.begins[:head], matches.ends[:head])
+    spliced.extend(window_matches)
+    spliced.begins.extend(array('q', map(delta.__add__, matches.begins[tail:])))
+    spliced.ends.extend(array('q', map(delta.__add__, matches.ends[tail:])))
+    return spliced
+
+class MatchCache(object):
+    """
+    The matches of each pattern in the latest text of each buffer, shared by all views of the buffer.
+    The matches are cached for the whole buffer and for scanned windows. The cached Matches must not be modified.
+    """
+    def __init__(self):
+        # The latest version of each buffer by buffer id
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def get(self, buffer_id, change_count, regex, window=None):
+        """
+        The matches of the regex in the text at the change count, or None if they have not been cached
+        @param buffer_id The buffer id of the view, which is looked up once by the caller for all of its words
+        """
+        with self.lock:
+            version = self.buffers.get(buffer_id)
+            if version is None or version.change_count != change_count:
+                return None
+            return version.get_whole(regex) if window is None else version.get_window(regex, window)
+
+    def put(self, buffer_id, change_count, size, regex, window, found):
+        with self.lock:
+            version = self.buffers.get(buffer_id)
+            if version is None or version.change_count < change_count:
+                if version is not None and version.splice is None:
+                    # The older versions can no longer be derived from
+                    version.previous = None
+                version = self.buffers[buffer_id] = BufferMatches(change_count, size, version)
+            elif version.change_count != change_count:
+                return
+            version.put(regex, window, found)
+
+    def carry_over(self, view, since, change_count, window, window_found):
+        """
+        Lets the matches of the whole buffer be derived from the previous version, after the window has been scanned
+        @param since The change count since when all edits lie within the window
+        @param window_found The matches of the words within the window, at the change count
+        """
+        with self.lock:
+            version = self.buffers.get(view.buffer_id())
+            if version is None or version.change_count != change_count or version.splice is not None:
+                return
+            previous = version.previous
+            version.previous = None
+            if previous is None or since is None or previous.change_count < since:
+                return
+            delta = version.size - previous.size
+            if window.end() - delta < window.begin():
+                return
+            version.previous = previous
+            version.splice = (window.begin(), window.end() - delta, delta, window_found)
+            version.depth = previous.depth + 1
+            if version.depth >= BufferMatches.max_depth:
+                # Derive the matches now instead of dropping them, which only has to be done once per max_depth edits
+                for regex in window_found:
+                    version.get_whole(regex)
+                version.previous = None
+                version.splice = None
+                version.depth = 0
+
+    def forget(self, buffer_id):
+        with self.lock:
+            self.buffers.pop(buffer_id, None)
+
+match_cache = MatchCache()
+
+class Matches(object):
+    """
+    The matches of a word, stored compactly as arrays of their begin and end points in the order they were found.
+    Iterating over them gives Region objects, which are only created when they are needed.
+    """
+    __slots__ = ("begins", "ends")
+
+    def __init__(self, begins=None, ends=None):
+        self.begins = array('q') if begins is None else begins
+        self.ends = array('q') if ends is None else ends
+
+    @classmethod
+    def from_regions(cls, regions):
+        matches = cls()
+        for r in regions:
+            matches.append(r.begin(), r.end())
+        return matches
+
+    def append(self, begin, end):
+        self.begins.append(begin)
+        self.ends.append(end)
+
+    def extend(self, matches):
+        self.begins.extend(matches.begins)
+        self.ends.extend(matches.ends)
+
+    def beginning_within(self, begin, end):
+        """The matches that begin between begin and end (inclusive), if the matches are sorted"""
+        start = bisect.bisect_left(self.begins, begin)
+        stop = bisect.bisect_right(self.begins, end)
+        return Matches(self.begins[start:stop], self.ends[start:stop])
+
+    def within(self, begin, end):
+        """The matches that lie within begin and end, if the matches are sorted"""
+        start = bisect.bisect_left(self.begins, begin)
+        stop = bisect.bisect_right(self.begins, end)
+        inside = Matches()
+        for b, e in zip(self.begins[start:stop], self.ends[start:stop]):
+            if e <= end:
+                inside.append(b, e)
+        return inside
+
+    def next_after(self, point):
+        """The first match that begins after the point, or None, if the matches are sorted"""
+        index = bisect.bisect_right(self.begins, point)
+        return sublime.Region(self.begins[index], self.ends[index]) if index < len(self.begins) else None
+
+    def previous_before(self, point):
+        """The last match that begins before the point, or None, if the matches are sorted"""
+        index = bisect.bisect_left(self.begins, point) - 1
+        return sublime.Region(self.begins[index], self.ends[index]) if index >= 0 else None
+
+    def to_regions(self):
+        return [sublime.Region(b, e) for b, e in zip(self.begins, self.ends)]
+
+    def __iter__(self):
+        return iter(self.to_regions())
+
+    def __len__(self):
+        return len(self.begins)
+
+class MatchIndex(object):
+    """
+    The matches of several regexes in one version of a buffer, merged into one index that is sorted by their begin
+    points, together with the number of the regex of each match. Unlike the matches of one regex, the merged matches
+    may overlap each other, so a lookup of the matches that overlap a region only looks back from the bisected
+    position by the length of the longest match.
+    Building the index sorts all of the matches, so it is done off the UI thread. After edits within a single
+    window, the index is derived from the previous one like the match cache derives the matches of the buffer.
+    """
+    def __init__(self, regexes, change_count, size, window=None):
+        """@param window The region that the matches were found in, or None if they cover the whole buffer"""
+        self.regexes = tuple(regexes)
+        self.change_count = change_count
+        self.size = size
+        self.window = window
+        self.begins = array('q')
+        self.ends = array('q')
+        self.regex_indices = array('l')
+        self.longest = 0
+
+    @classmethod
+    def build(cls, regexes, found, change_count, size, window=None):
+        """@param found dict from regex to the Matches of each of the regexes"""
+        index = cls(regexes, change_count, size, window)
+        merged = sorted((b, e, i) for i, regex in enumerate(index.regexes) for b, e in zip(found[regex].begins, found[regex].ends))
+        index.begins = array('q', (m[0] for m in merged))
+        index.ends = array('q', (m[1] for m in merged))
+        index.regex_indices = array('l', (m[2] for m in merged))
+        index.longest = max([e - b for b, e, _ in merged] or [0])
+        return index
+
+    def splice(self, window, window_found, change_count, size):
+        """
+        The index of the next version of the buffer, where all edits lie within the window that has been scanned again.
+        The matches in the window are replaced by its new matches, and the matches after it are moved by the change in size.
+        @return The derived MatchIndex, or None if the edits do not fit in the window
+        """
+        delta = size - self.size
+        old_end = window.end() - delta
+        if self.window is not None or old_end < window.begin():
+            return None
+        window_index = MatchIndex.build(self.regexes, window_found, change_count, size)
+        head = bisect.bisect_left(self.begins, window.begin())
+        tail = bisect.bisect_right(self.begins, old_end)
+        index = MatchIndex(self.regexes, change_count, size)
+        index.begins = self.begins[:head] + window_index.begins + array('q', map(delta.__add__, self.begins[tail:]))
+        index.ends = self.ends[:head] + window_index.ends + array('q', map(delta.__add__, self.ends[tail:]))
+        index.regex_indices = self.regex_indices[:head] + window_index.regex_indices + self.regex_indices[tail:]
+        # The longest match may have been replaced, which only makes the lookups look back a little further
+        index.longest = max(self.longest, window_index.longest)
+        return index
+
+    def regexes_at(self, begin, end):
+        """The first match of each regex that overlaps the region between begin and end, as a list of (regex, region) in the order of the regexes"""
+        start = bisect.bisect_right(self.begins, begin - self.longest)
+        stop = bisect.bisect_left(self.begins, end)
+        hits = {}
+        for i in range(start, stop):
+            if self.ends[i] > begin and self.regex_indices[i] not in hits:
+                hits[self.regex_indices[i]] = sublime.Region(self.begins[i], self.ends[i])
+        return [(self.regexes[i], hits[i]) for i in sorted(hits)]
+
+    def next_after(self, point, regex=None):
+        """
+        The first match of the regex, or of any regex if None, that begins after the point, or None.
+        The matches of a single regex are found by walking the index from the bisected position.
+        """
+        index = bisect.bisect_right(self.begins, point)
+        if regex is not None:
+            wanted = self.regexes.index(regex)
+            while index < len(self.begins) and self.regex_indices[index] != wanted:
+                index += 1
+        return sublime.Region(self.begins[index], self.ends[index]) if index < len(self.begins) else None
+
+    def previous_before(self, point, regex=None):
+        """The last match of the regex, or of any regex if None, that begins before the point, or None"""
+        index = bisect.bisect_left(self.begins, point) - 1
+        if regex is not None:
+            wanted = self.regexes.index(regex)
+            while index >= 0 and self.regex_indices[index] != wanted:
+                index -= 1
+        return sublime.Region(self.begins[index], self.ends[index]) if index >= 0 else None
+
+@functools.lru_cache(maxsize=8)
+def word_literals_regex(literals):
+    return '\\b(?:' + literals_to_regex(literals) + ')\\b'
+
+def find_all_combined(text, words, begin, end, offset=0):
+    """Scans the text once for all words, routing each match to the word with the same text"""
+    regex_by_literal = {w.get_literal(): w.get_regex() for w in words}
+    pattern = patterns.get(word_literals_regex(tuple(sorted(regex_by_literal.keys()))))
+    regions = {r: Matches() for r in regex_by_literal.values()}
+    for m in pattern.finditer(text, begin, end):
+        regions[regex_by_literal[m.group()]].append(offset + m.start(), offset + m.end())
+    return regions
+
+class PatternTooSlow(Exception):
+    def __init__(self, regex, seconds, match_count):
+        super(PatternTooSlow, self).__init__(regex, seconds, match_count)
+        self.regex = regex
+        self.seconds = seconds
+        self.match_count = match_count
+
+# The number of matches between the checks of the budget of a scan
+BUDGET_CHECK_INTERVAL = 256
+
+class PatternBudget(object):
+    """
+    Limits the time and the number of matches that a single scan of a regex may take. A regex that exceeds
+    the budget in a buffer, for example because it backtracks catastrophically, is suspended there: it is
+    no longer scanned for, so that it does not slow down every update of the other highlights.
+    Python's re cannot be interrupted within a match, so the budget is checked between the matches.
+    """
+    def __init__(self):
+        # The cost of the suspended regexes, as (seconds, number of matches) by (buffer id, regex)
+        self.suspended = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_limits():
+        """The time budget [seconds] and the maximum number of matches of a scan"""
+        settings = helpers.get_settings()
+        return settings.get("pattern_time_budget", 1.0), settings.get("pattern_max_matches", 1000000)
+
+    def is_suspended(self, buffer_id, regex):
+        """@param buffer_id The buffer id of the view, which is looked up once by the caller for all of its words"""
+        return (buffer_id, regex) in self.suspended
+
+    def get_suspended(self, view, words):
+        """The regexes of the words that are suspended in the buffer of the view"""
+        buffer_id = view.buffer_id()
+        return frozenset(w.get_regex() for w in words if (buffer_id, w.get_regex()) in self.suspended)
+
+    def get_cost(self, buffer_id, regex):
+        """The (seconds, number of matches) that the regex took before it was suspended, or None"""
+        return self.suspended.get((buffer_id, regex))
+
+    def suspend(self, view, regex, seconds, match_count):
+        with self.lock:
+            self.suspended[(view.buffer_id(), regex)] = (seconds, match_count)
+        logger.warning("Suspended the regex %s in view %d, since a scan of it took %.2f s and found %d matches", regex, view.id(), seconds, match_count)
+        sublime.status_message("Word Highlighter: suspended the slow regex {}".format(regex))
+
+    def resume(self, view, regex):
+        with self.lock:
+            self.suspended.pop((view.buffer_id(), regex), None)
+
+    def forget(self, buffer_id):
+        with self.lock:
+            for key in [k for k in self.suspended if k[0] == buffer_id]:
+                del self.suspended[key]
+
+budget = PatternBudget()
+
+def find_regions(view, text, word, begin, end, offset=0, limits=None):
+    """
+    Finds the regions of a single word that lie between begin and end of the text
+    @param limits The (time budget, maximum number of matches) of the scan, or None to read them from the settings
+    @raise PatternTooSlow if the scan exceeds the budget
+    """
+    pattern = patterns.get(word.get_regex())
+    if pattern is None:
+        # Not a pattern that Python understands, let Sublime find it in the whole buffer instead
+        regions = view.find_all(word.get_regex())
+        return Matches.from_regions(r for r in regions if offset + begin <= r.begin() and r.end() <= offset + end)
+    time_budget, max_matches = budget.get_limits() if limits is None else limits
+    start = time.perf_counter()
+    next_check = BUDGET_CHECK_INTERVAL
+    matches = Matches()
+    for m in pattern.finditer(text, begin, end):
+        matches.append(offset + m.start(), offset + m.end())
+        if len(matches) >= next_check:
+            seconds = time.perf_counter() - start
+            if seconds > time_budget or len(matches) > max_matches:
+                raise PatternTooSlow(word.get_regex(), seconds, len(matches))
+            next_check += BUDGET_CHECK_INTERVAL
+    # A single match that backtracks for long is only noticed when it is done
+    seconds = time.perf_counter() - start
+    if seconds > time_budget:
+        raise PatternTooSlow(word.get_regex(), seconds, len(matches))
+    return matches
+
+# Below this number of literals, scanning for each of them separately is faster than using a LiteralMatcher
+LITERAL_MATCHER_MIN_LITERALS = 32
+
+class LiteralMatcher(object):
+    """
+    Finds all occurrences of a set of literals in a single pass over the text.
+    The literals are merged into a trie. A lookahead of the trie, compiled as a regex, finds every
+    position where any of the literals starts. Walking the trie from there gives all literals that start
+    at that position, so literals that overlap each other are found as well.
+    At each such position the lookahead and the walk take up to the length of the longest literal, so a scan
+    takes O(len(text) * longest literal) time in the worst case, not linear time.
+    """
+    def __init__(self, literals):
+        self.trie = build_trie(literals)
+        self.starts = patterns.get('(?=' + trie_to_regex(self.trie) + ')')
+
+    def find_all(self, text, begin, end):
+        """
+        Finds the occurrences of the literals between begin and end of the text. Like find_all, the
+        occurrences of each literal are found from left to right without overlapping each other.
+        @return dict from literal to a list of (begin, end) tuples
+        """
+        occurrences = {}
+        occurrence_end = {}
+        for m in self.starts.finditer(text, begin, end):
+            start = position = m.start()
+            node = self.trie
+            while node is not None:
+                literal = node.get('')
+                if literal is not None and start >= occurrence_end.get(literal, start):
+                    occurrences.setdefault(literal, []).append((start, position))
+                    occurrence_end[literal] = position
+                if position >= end:
+                    break
+                node = node.get(text[position])
+                position += 1
+        return occurrences
+
+@functools.lru_cache(maxsize=8)
+def get_literal_matcher(literals):
+    """Returns a matcher for the tuple of literals, only building it again when the literals change"""
+    return LiteralMatcher(literals)
+
+def find_all_literals(text, words, begin, end, offset=0):
+    """Scans the text once for all plain literal words"""
+    regex_by_literal = {w.get_literal(): w.get_regex() for w in words}
+    matcher = get_literal_matcher(tuple(sorted(regex_by_literal.keys())))
+    if matcher.starts is None:
+        return {}
+    regions = {r: Matches() for r in regex_by_literal.values()}
+    for literal, occurrences in matcher.find_all(text, begin, end).items():
+        matches = regions[regex_by_literal[literal]]
+        for b, e in occurrences:
+            matches.append(offset + b, offset + e)
+    return regions
+
+class ScanCancelled(Exception):
+    pass
+
+def find_all_regions(view, words, region=None, cancelled=None):
+    """
+    Finds the regions of all words in the view, matching them in-process against a snapshot of the buffer.
+    Whole words that can be combined are found in a single scan, and so are plain literals when there
+    are many of them. The rest are scanned one by one.
+    @param region Only search within this region, or the whole buffer if None. Only the region is read
+        from the view if there is no snapshot of the current text, since it is usually small.
+    @param cancelled Function that is checked between the scans, raising ScanCancelled if it returns True
+    @return dict from the regex of each word to its Matches
+    The matches are cached for the change count of the buffer, so that other views of the same buffer
+    reuse them instead of scanning the same text again.
+    """
+    # The view is only asked once for its buffer, not for each word
+    buffer_id = view.buffer_id()
+    change_count = view.change_count()
+    size = view.size()
+    window = None if region is None else (region.begin(), region.end())
+    regions = {}
+    missing = []
+    for w in words:
+        if budget.is_suspended(buffer_id, w.get_regex()):
+            regions[w.get_regex()] = Matches()
+            continue
+        cached = match_cache.get(buffer_id, change_count, w.get_regex(), window)
+        if cached is None:
+            missing.append(w)
+        else:
+            regions[w.get_regex()] = cached
+    # Other views of the buffer or earlier updates may already have scanned for all of the words
+    if not missing:
+        return regions
+    scanned = scan_regions(view, missing, region, cancelled)
+    # Only cache the matches if the text did not change while it was scanned
+    if view.change_count() == change_count:
+        for regex, found in scanned.items():
+            # The empty matches of a regex that was suspended during the scan are not its real matches
+            if not budget.is_suspended(buffer_id, regex):
+                match_cache.put(buffer_id, change_count, size, regex, window, found)
+    regions.update(scanned)
+    return regions
+
+def find_cached_regions(view, words, change_count):
+    """The cached matches of the words in the whole buffer, or None if any of them has to be scanned"""
+    buffer_id = view.buffer_id()
+    regions = {}
+    for w in words:
+        if budget.is_suspended(buffer_id, w.get_regex()):
+            regions[w.get_regex()] = Matches()
+            continue
+        cached = match_cache.get(buffer_id, change_count, w.get_regex())
+        if cached is None:
+            return None
+        regions[w.get_regex()] = cached
+    return regions
+
+def scan_regions(view, words, region=None, cancelled=None):
+    """
+    Scans the text for the words without looking in the cache, with the same arguments as find_all_regions.
+    The regexes that are suspended by the budget, or that exceed it during the scan, get no matches.
+    """
+    text = get_snapshot(view) if region is None else get_cached_snapshot(view)
+    if text is None:
+        text = view.substr(region)
+        offset, begin, end = region.begin(), 0, len(text)
+    else:
+        offset, begin, end = (0, 0, len(text)) if region is None else (0, region.begin(), region.end())
+    buffer_id = view.buffer_id()
+    regions = {w.get_regex(): Matches() for w in words if budget.is_suspended(buffer_id, w.get_regex())}
+    words = [w for w in words if w.get_regex() not in regions]
+    combinable = [w for w in words if is_combinable(w)]
+    if combinable:
+        with stats.timer(view, "scan_combined"):
+            regions.update(find_all_combined(text, combinable, begin, end, offset))
+    limits = budget.get_limits()
+    literals = [w for w in words if is_plain_literal(w)]
+    if len(literals) >= LITERAL_MATCHER_MIN_LITERALS:
+        with stats.timer(view, "scan_literals"):
+            regions.update(find_all_literals(text, literals, begin, end, offset))
+    for w in words:
+        if cancelled is not None and cancelled():
+            raise ScanCancelled()
+        if w.get_regex() not in regions:
+            try:
+                with stats.timer(view, "scan_word"):
+                    regions[w.get_regex()] = find_regions(view, text, w, begin, end, offset, limits)
+            except PatternTooSlow as e:
+                budget.suspend(view, e.regex, e.seconds, e.match_count)
+                regions[w.get_regex()] = Matches()
+    return regions
+
+def expand_to_lines(view, region, margin_lines=0):
+    """Expands the region to whole lines, with margin_lines extra lines above and below"""
+    last_row = view.rowcol(view.size())[0]
+    first_row = max(0, view.rowcol(region.begin())[0] - margin_lines)
+    last_row = min(last_row, view.rowcol(region.end())[0] + margin_lines)
+    return sublime.Region(view.text_point(first_row, 0), view.line(view.text_point(last_row, 0)).end())
+
+def merge_regions(regions):
+    """Merges overlapping and adjacent regions into a sorted list of disjoint regions"""
+    merged = []
+    for r in sorted(regions, key=lambda r: r.begin()):
+        if merged and r.begin() <= merged[-1].end():
+            merged[-1] = merged[-1].cover(r)
+        else:
+            merged.append(sublime.Region(r.begin(), r.end()))
+    return merged
+
+def bisect_regions(regions, point):
+    """Index of the first region in the sorted list that begins at or after the point"""
+    lo, hi = 0, len(regions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if regions[mid].begin() < point:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def splice_regions(regions, windows, found):
+    """
+    Replaces the regions that begin within each window by the regions that were found there
+    @param regions Sorted list of regions
+    @param windows Sorted list of disjoint windows
+    @param found List with the regions found in each of the windows
+    """
+    spliced = []
+    last_stop = 0
+    for w, found_regions in zip(windows, found):
+        start = max(last_stop, bisect_regions(regions, w.begin()))
+        spliced.extend(regions[last_stop:start])
+        spliced.extend(found_regions)
+        last_stop = max(start, bisect_regions(regions, w.end() + 1))
+    spliced.extend(regions[last_stop:])
+    return spliced
+
+def is_spliced(regions, windows, found):
+    """Whether the regions that begin within each window already are the regions that were found there"""
+    last_stop = 0
+    for w, found_regions in zip(windows, found):
+        start = max(last_stop, bisect_regions(regions, w.begin()))
+        last_stop = max(start, bisect_regions(regions, w.end() + 1))
+        if regions[start:last_stop] != found_regions:
+            return False
+    return True
+
+def intersecting_slice(regions, window):
+    """Returns the indices (start, stop) of the sorted regions that touch the window"""
+    stop = bisect_regions(regions, window.end() + 1)
+    start = bisect_regions(regions, window.begin())
+    while start > 0 and regions[start - 1].end() >= window.begin():
+        start -= 1
+    return start, stop
@@ -1,6 +1,8 @@
 import sublime
 import logging
-import inspect
+import logging.handlers
+import queue
+import sys
 
 import os
 __dir__ = os.path.dirname(os.path.realpath(__file__))
@@ -21,8 +23,20 @@ def plugin_loaded():
     #  Make sure output directories exist
     os.makedirs(dirs.logs, exist_ok=True)
     os.makedirs(dirs.color_schemes, exist_ok=True)
+    _log_listener.start()
+    settings = get_settings()
+    settings.clear_on_change(__name__)
+    settings.add_on_change(__name__, update_log_level)
     _is_loaded = True
 
+def plugin_unloaded():
+    global _is_loaded
+    if not _is_loaded:
+        return
+    # Writes the remaining records before returning
+    _log_listener.stop()
+    _is_loaded = False
+
 # Check that select bits are set
 def bits_set(value, *bits):
     from functools import reduce
@@ -37,18 +51,65 @@ def get_logfile_path(filename):
 def get_settings():
     return sublime.load_settings("word_highlighter.sublime-settings")
 
-def get_logger(module_name=None, file_name=None):
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+def get_log_level():
+    level = get_settings().get("log_level", "INFO")
+    if not isinstance(level, str) or level.upper() not in LOG_LEVELS:
+        return logging.INFO
+    return getattr(logging, level.upper())
+
+def update_log_level():
+    level = get_log_level()
+    for logger in _loggers.values():
+        logger.setLevel(level)
 
-    if module_name is None or file_name is None:
-        caller_frame = inspect.stack()[1]
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the records in the queue without formatting them, so that the message is only formatted
+    with its arguments on the thread that writes it
+    """
+    def prepare(self, record):
+        return record
 
+class FileRouter(logging.Handler):
+    """Passes each record on to the file handler of the logger that made it"""
+    def __init__(self):
+        super(FileRouter, self).__init__()
+        self.handlers = {}
+
+    def handle(self, record):
+        handler = self.handlers.get(record.name)
+        if handler is not None:
+            handler.handle(record)
+
+    def set_handler(self, name, handler):
+        previous = self.handlers.get(name)
+        self.handlers[name] = handler
+        if previous is not None:
+            previous.flush()
+            previous.close()
+
+# The records of all loggers go through the queue, and are written to their files by a background thread
+_log_queue = queue.Queue()
+_log_router = FileRouter()
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_router)
+# The loggers that have been created by module name
+_loggers = {}
+
+def get_logger(module_name=None, file_name=None):
+    """
+    Gets the logger of the calling module, which writes to its own file in the logs folder.
+    Pass the arguments of a message separately, like logger.debug("Found %d regions", count),
+    so that it is only formatted if the level is enabled.
+    """
     if file_name is None:
-        file_name = caller_frame[1]
+        file_name = sys._getframe(1).f_code.co_filename
     if module_name is None:
         module_name = os.path.splitext(os.path.basename(file_name))[0]
 
     logger = logging.getLogger(module_name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(get_log_level())
 
     # Make sure to remove old handlers before adding new one (necessary when reloading package)
     handlers = list(logger.handlers)
@@ -61,5 +122,7 @@ def get_logger(module_name=None, file_name=None):
     fh = logging.FileHandler(get_logfile_path(file_name), mode='w')
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter('%(asctime)-23s: %(name)-15s: %(levelname)-10s: %(message)s'))
-    logger.addHandler(fh)
+    _log_router.set_handler(module_name, fh)
+    logger.addHandler(LazyQueueHandler(_log_queue))
+    _loggers[module_name] = logger
     return logger
@@ -0,0 +1,239 @@
+import sublime
+from . import helpers
+from . import engine
+from collections import Counter, OrderedDict
+import bisect
+import collections
+import concurrent.futures
+import fnmatch
+import mmap
+import os
+import threading
+import time
+
+logger = None
+
+def plugin_loaded():
+    global logger
+    helpers.plugin_loaded()
+    logger = helpers.get_logger()
+    logger.info("Loading " + __name__)
+
+def plugin_unloaded():
+    for indexer in list(ProjectIndexer.running.values()):
+        indexer.cancel()
+
+# The files that are read to tell if a file is binary [bytes]
+BINARY_SNIFF_SIZE = 8192
+# The size of the pieces of whole lines that files are decoded and scanned in [bytes]
+CHUNK_SIZE = 1024 ** 2
+
+def get_pattern(regex):
+    """
+    The pattern of the regex, or None if Python does not understand it. The files are decoded before they are
+    scanned, since bytes patterns only know ASCII word characters and would miss words like 'café'.
+    """
+    return engine.patterns.get(regex)
+
+def get_exclude_patterns():
+    """The folder and file name patterns that Sublime Text leaves out of Find in Files"""
+    preferences = sublime.load_settings("Preferences.sublime-settings")
+    folder_patterns = preferences.get("folder_exclude_patterns", [])
+    file_patterns = preferences.get("file_exclude_patterns", []) + preferences.get("binary_file_patterns", [])
+    return folder_patterns, file_patterns
+
+def iterate_files(folders, folder_patterns=(), file_patterns=()):
+    """The paths of all files in the folders and their subfolders, except the excluded ones"""
+    def is_excluded(name, patterns):
+        return any(fnmatch.fnmatch(name, p) for p in patterns)
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = sorted(d for d in dirs if not is_excluded(d, folder_patterns))
+            for f in sorted(files):
+                if not is_excluded(f, file_patterns):
+                    yield os.path.join(root, f)
+
+def scan_file(path, patterns):
+    """
+    Finds the lines that the patterns match on in a file, without reading all of it into memory at once
+    @param patterns List of (regex, compiled pattern)
+    @return dict from regex to a list of (line number, number of matches on the line), or None if nothing matched
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if b"\0" in data[:BINARY_SNIFF_SIZE]:
+                    return None
+                return find_lines(iterate_chunks(data), patterns)
+    except (OSError, ValueError) as e:
+        logger.debug("Could not scan %s: %s", path, e)
+        return None
+
+def iterate_chunks(data, chunk_size=CHUNK_SIZE):
+    """Splits the bytes into pieces that end at a line break, decoded as UTF-8"""
+    begin = 0
+    while begin < len(data):
+        end = data.find(b"\n", begin + chunk_size)
+        end = len(data) if end < 0 else end + 1
+        yield data[begin:end].decode("utf-8", "replace")
+        begin = end
+
+def find_lines(chunks, patterns):
+    """
+    @param chunks The text in pieces of whole lines. Matches that span two pieces are not found.
+    """
+    hits = OrderedDict()
+    # The number of the first line of the chunk
+    first_line = 1
+    for text in chunks:
+        line_starts = None
+        for regex, pattern in patterns:
+            if pattern.search(text) is None:
+                continue
+            # The lines are only located in chunks where something matched
+            if line_starts is None:
+                line_starts = [0]
+                position = text.find("\n")
+                while position >= 0:
+                    line_starts.append(position + 1)
+                    position = text.find("\n", position + 1)
+            lines = hits.setdefault(regex, OrderedDict())
+            for m in pattern.finditer(text):
+                line = first_line - 1 + bisect.bisect_right(line_starts, m.start())
+                lines[line] = lines.get(line, 0) + 1
+        first_line += text.count("\n")
+    return {regex: list(lines.items()) for regex, lines in hits.items()} or None
+
+class OccurrenceIndex(object):
+    """The lines of each file that the highlights occur on, and the number of occurrences of each highlight"""
+    def __init__(self, regexes):
+        self.regexes = list(regexes)
+        # Dict from path to the hits of scan_file, for the files with any hits
+        self.files = OrderedDict()
+        self.counts = Counter()
+        self.file_counts = Counter()
+        self.scanned_files = 0
+
+    def add(self, path, hits):
+        self.scanned_files += 1
+        if hits is None:
+            return
+        self.files[path] = hits
+        for regex, lines in hits.items():
+            self.counts[regex] += sum(count for _, count in lines)
+            self.file_counts[regex] += 1
+
+    def format_hits(self, path, hits):
+        """One line per line of the file, with the highlights that occur on it, like 'path:12: regex (2), regex'"""
+        by_line = collections.defaultdict(list)
+        for regex in self.regexes:
+            for line, count in hits.get(regex, ()):
+                by_line[line].append(regex if count == 1 else "{} ({})".format(regex, count))
+        return ["{}:{}: {}".format(path, line, ", ".join(by_line[line])) for line in sorted(by_line)]
+
+    def format_summary(self):
+        lines = ["Occurrences in {} of {} files:".format(len(self.files), self.scanned_files)]
+        for regex in self.regexes:
+            lines.append("    {}: {} in {} files".format(regex, self.counts[regex], self.file_counts[regex]))
+        return lines
+
+class ProjectIndexer(object):
+    """
+    Builds the occurrence index of the highlights in all files of the project folders of a window.
+    The files are scanned by a pool of threads, and the hits are appended to an output panel as they arrive.
+    """
+    panel_name = "word_highlighter_occurrences"
+    # The running indexer of each window, by window id
+    running = {}
+
+    def __init__(self, window, words):
+        self.window = window
+        self.index = OccurrenceIndex(w.get_regex() for w in words)
+        self.patterns = [(w.get_regex(), get_pattern(w.get_regex())) for w in words]
+        for regex, pattern in self.patterns:
+            if pattern is None:
+                logger.warning("Leaving out %s from the occurrence index, since it is not a pattern that Python understands", regex)
+        self.patterns = [p for p in self.patterns if p[1] is not None]
+        self.folders = window.folders()
+        self.cancelled = False
+        self.done = False
+        # The (path, hits) of the scanned files that have not been shown yet
+        self.arrived = collections.deque()
+        self.panel = None
+        self.start_time = 0
+
+    def start(self):
+        previous = ProjectIndexer.running.get(self.window.id())
+        if previous is not None:
+            previous.cancel()
+        ProjectIndexer.running[self.window.id()] = self
+        self.start_time = time.perf_counter()
+        self.panel = self.window.create_output_panel(self.panel_name)
+        self.panel.settings().set("result_file_regex", r"^(.+):(\d+): ")
+        if len(self.folders) == 1:
+            self.panel.settings().set("result_base_dir", self.folders[0])
+        self.append(["Indexing the occurrences of {} highlights in {}".format(len(self.patterns), ", ".join(self.folders)), ""])
+        self.window.run_command("show_panel", {"panel": "output." + self.panel_name})
+        threading.Thread(target=self.scan, name="word_highlighter.occurrences", daemon=True).start()
+        self.show_progress()
+
+    def cancel(self):
+        self.cancelled = True
+        if ProjectIndexer.running.get(self.window.id()) is self:
+            del ProjectIndexer.running[self.window.id()]
+
+    def scan(self):
+        """Walks the folders on a background thread, and scans each file on the pool"""
+        settings = helpers.get_settings()
+        thread_count = max(1, settings.get("occurrence_index_threads", 4))
+        # Limits the number of files that are waiting for the pool, so that the walk does not run far ahead
+        in_flight = threading.BoundedSemaphore(thread_count * 4)
+        folder_patterns, file_patterns = get_exclude_patterns()
+        def scanned(path, future):
+            in_flight.release()
+            self.arrived.append((path, future.result()))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+                for path in iterate_files(self.folders, folder_patterns, file_patterns):
+                    if self.cancelled:
+                        break
+                    in_flight.acquire()
+                    future = executor.submit(scan_file, path, self.patterns)
+                    future.add_done_callback(lambda future, path=path: scanned(path, future))
+        except Exception:
+            logger.exception("Indexing the occurrences failed")
+        finally:
+            self.done = True
+
+    def show_progress(self):
+        """Appends the hits that have arrived to the panel on the UI thread, until all files are scanned"""
+        if self.cancelled:
+            return
+        done = self.done
+        lines = []
+        while self.arrived:
+            path, hits = self.arrived.popleft()
+            self.index.add(path, hits)
+            if hits is not None:
+                lines.extend(self.index.format_hits(self.get_display_path(path), hits))
+        if lines:
+            self.append(lines)
+        if done:
+            elapsed = time.perf_counter() - self.start_time
+            self.append([""] + self.index.format_summary())
+            logger.info("Indexed the occurrences of %d highlights in %d files in %.1f s", len(self.patterns), self.index.scanned_files, elapsed)
+            sublime.status_message("Word Highlighter: indexed {} files in {:.1f} s".format(self.index.scanned_files, elapsed))
+            self.cancel()
+            return
+        sublime.status_message("Word Highlighter: indexed {} files, {} with occurrences".format(self.index.scanned_files, len(self.index.files)))
+        interval = helpers.get_settings().get("occurrence_index_publish_interval", 0.2)
+        sublime.set_timeout(self.show_progress, int(interval * 1000))
+
+    def get_display_path(self, path):
+        """The path relative to the folder if there is only one, which is the base dir of the panel"""
+        return os.path.relpath(path, self.folders[0]) if len(self.folders) == 1 else path
+
+    def append(self, lines):
+        self.panel.run_command("append", {"characters": "\n".join(lines) + "\n", "force": True, "scroll_to_end": False})
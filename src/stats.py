@@ -0,0 +1,98 @@
+from . import helpers
+import collections
+import math
+import time
+
+logger = None
+# Cached value of the timing_stats setting, so that a disabled timer does not have to read the settings
+enabled = False
+
+def plugin_loaded():
+    global logger
+    helpers.plugin_loaded()
+    logger = helpers.get_logger()
+    logger.info("Loading " + __name__)
+    settings = helpers.get_settings()
+    settings.clear_on_change(__name__)
+    settings.add_on_change(__name__, update_enabled)
+    update_enabled()
+
+def update_enabled():
+    global enabled
+    enabled = bool(helpers.get_settings().get("timing_stats", False))
+
+class RollingHistogram(object):
+    """The most recent samples of the duration of a phase, for computing its percentiles"""
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.count += 1
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """Nearest-rank percentiles of the recent samples, or None for each if there are none"""
+        samples = sorted(self.samples)
+        if not samples:
+            return [None] * len(percents)
+        return [samples[max(0, int(math.ceil(p / 100 * len(samples))) - 1)] for p in percents]
+
+# The histograms of each view by view id, as a dict from phase to histogram
+histograms = {}
+
+def record(view, phase, seconds):
+    view_histograms = histograms.get(view.id())
+    if view_histograms is None:
+        view_histograms = histograms.setdefault(view.id(), {})
+    histogram = view_histograms.get(phase)
+    if histogram is None:
+        histogram = view_histograms.setdefault(phase, RollingHistogram())
+    histogram.add(seconds)
+
+class Timer(object):
+    """Records the time spent in a with block as a sample of the phase"""
+    __slots__ = ("view", "phase", "start")
+
+    def __init__(self, view, phase):
+        self.view = view
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(self.view, self.phase, time.perf_counter() - self.start)
+
+class NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_null_timer = NullTimer()
+
+def timer(view, phase):
+    """Times a with block if timing stats are enabled"""
+    return Timer(view, phase) if enabled else _null_timer
+
+def get_summary(view):
+    view_histograms = histograms.get(view.id(), {})
+    if not view_histograms:
+        if not enabled:
+            return "Timing stats are disabled. Enable them with the timing_stats setting.\n"
+        return "No timing stats have been recorded for this view yet.\n"
+    lines = ["{:<20} {:>8} {:>10} {:>10} {:>10}".format("phase", "count", "p50 [ms]", "p95 [ms]", "p99 [ms]")]
+    for phase in sorted(view_histograms.keys()):
+        histogram = view_histograms[phase]
+        p50, p95, p99 = histogram.percentiles()
+        lines.append("{:<20} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}".format(phase, histogram.count, p50 * 1000, p95 * 1000, p99 * 1000))
+    return "\n".join(lines) + "\n"
+
+def log_summary(view):
+    if view.id() in histograms:
+        logger.info("Timing stats of view %d (%s):\n%s", view.id(), view.file_name(), get_summary(view))
+
+def forget_stats(view):
+    histograms.pop(view.id(), None)
@@ -0,0 +1,241 @@
+import sublime
+from . import helpers
+from . import engine
+from . import stats
+import collections
+import functools
+import logging
+import threading
+import time
+
+logger = None
+
+def plugin_loaded():
+    global logger
+    helpers.plugin_loaded()
+    logger = helpers.get_logger()
+    logger.info("Loading " + __name__)
+    worker.start()
+
+def plugin_unloaded():
+    worker.stop()
+
+class ScanJob(object):
+    """
+    A scan of the words of a collection, made for a specific change count of the view.
+    The scan runs on the worker thread and is committed on the UI thread, unless the buffer has changed since.
+    """
+    def __init__(self, collection, dirty_regions=None, on_commit=None, on_cost=None):
+        """
+        @param on_commit Called when the scan has been committed
+        @param on_cost Called with the time spent on the job [seconds] when it is done, whether it was committed or not
+        """
+        self.view = collection.view
+        self.collection = collection
+        # The key that the worker keeps the latest job by
+        self.job_key = self.view.id()
+        self.change_count = self.view.change_count()
+        # The words and the state of the collection are taken here on the UI thread, since the scan runs on a worker
+        self.snapshot = collection.snapshot()
+        self.words = self.snapshot.words
+        self.dirty_regions = dirty_regions
+        self.on_commit = on_commit
+        self.on_cost = on_cost
+        self.cost = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_stale(self):
+        return self.cancelled or self.view.change_count() != self.change_count
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            result = self.collection.scan(self.dirty_regions, self.is_stale, self.snapshot)
+        except engine.ScanCancelled:
+            logger.debug("Cancelled stale scan of view %d at change %d", self.view.id(), self.change_count)
+            self.done(time.perf_counter() - start)
+            return
+        self.cost = time.perf_counter() - start
+        sublime.set_timeout(functools.partial(self.commit, result), 0)
+
+    def commit(self, result):
+        start = time.perf_counter()
+        try:
+            if self.is_stale():
+                logger.debug("Dropped stale scan of view %d at change %d", self.view.id(), self.change_count)
+                return
+            if self.collection.commit(result) and self.on_commit is not None:
+                self.on_commit()
+        finally:
+            self.done(self.cost + time.perf_counter() - start)
+
+    def done(self, cost):
+        if stats.enabled:
+            stats.record(self.view, "update", cost)
+        if self.on_cost is not None:
+            self.on_cost(cost)
+
+class IndexJob(object):
+    """
+    Builds the match index of a collection, when a committed scan could not derive it from the previous index.
+    The matches of the whole buffer are usually cached by then, otherwise the buffer is scanned on the worker.
+    """
+    def __init__(self, collection):
+        self.view = collection.view
+        self.collection = collection
+        # The index of a view is built alongside its scans, without replacing them
+        self.job_key = ("index", self.view.id())
+        self.change_count = self.view.change_count()
+        self.size = self.view.size()
+        self.words = collection.words
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_stale(self):
+        return self.cancelled or self.view.change_count() != self.change_count
+
+    def run(self):
+        try:
+            found = engine.find_all_regions(self.view, self.words, cancelled=self.is_stale)
+        except engine.ScanCancelled:
+            logger.debug("Cancelled stale index of view %d at change %d", self.view.id(), self.change_count)
+            return
+        with stats.timer(self.view, "index"):
+            index = engine.MatchIndex.build([w.get_regex() for w in self.words], found, self.change_count, self.size)
+        sublime.set_timeout(functools.partial(self.commit, index), 0)
+
+    def commit(self, index):
+        if not self.is_stale():
+            self.collection.set_match_index(index)
+
+class AdaptiveDebounce(object):
+    """
+    Chooses the debounce delay of a view from the measured cost of its recent updates.
+    When typing continuously, an update that costs c seconds runs every delay + c seconds. To spend at most
+    the share s of the time on highlighting, the delay must be at least c * (1/s - 1). The delay is kept
+    between the debounce_min and debounce_max settings.
+    """
+    # The relative change of the delay since it was last logged at the info level, that is logged again
+    log_change = 0.5
+
+    def __init__(self, view, history=8):
+        self.view = view
+        self.costs = collections.deque(maxlen=history)
+        self.logged_delay = None
+
+    def add_cost(self, cost):
+        self.costs.append(cost)
+        delay = self.get_delay()
+        if stats.enabled:
+            stats.record(self.view, "debounce_delay", delay)
+        if self.logged_delay is None or abs(delay - self.logged_delay) > self.log_change * self.logged_delay:
+            logger.info("View %d: updates take %.1f ms, the debounce delay is now %.0f ms", self.view.id(), self.get_cost() * 1000, delay * 1000)
+            self.logged_delay = delay
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("View %d: update took %.1f ms, debounce is now %.0f ms", self.view.id(), cost * 1000, delay * 1000)
+
+    def get_cost(self):
+        """The mean cost of the recent updates [seconds]"""
+        costs = list(self.costs)
+        return sum(costs) / len(costs) if costs else 0
+
+    def get_delay(self):
+        """The time to wait after a modification before updating [seconds]"""
+        settings = helpers.get_settings()
+        if not settings.get("adaptive_debounce", True) or not self.costs:
+            return settings.get("debounce", 0.1)
+        cpu_share = settings.get("debounce_cpu_share", 0.25)
+        delay = self.get_cost() * (1 / cpu_share - 1)
+        return min(max(delay, settings.get("debounce_min", 0.02)), settings.get("debounce_max", 2.0))
+
+class ScanWorker(object):
+    """
+    A pool of long-lived threads that run scan jobs. Only the latest job of each key is kept, and a job that
+    is replaced by a newer one is cancelled, even while it is running. The jobs of a key run one at a time.
+    The scans of a view are kept by its view id, and its match index and the previews of its regexes by keys of their own.
+    Reading the text of a view waits for Sublime Text, so several threads keep scanning while others wait.
+    A job has a job_key and a view, and can be run and cancelled.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Pending jobs by key, in the order they were submitted
+        self.jobs = collections.OrderedDict()
+        # Running jobs by key
+        self.running = {}
+        self.threads = []
+        self.stopped = False
+
+    def start(self):
+        with self.condition:
+            if self.threads:
+                return
+            self.stopped = False
+            thread_count = max(1, helpers.get_settings().get("worker_threads", 2))
+            for i in range(thread_count):
+                thread = threading.Thread(target=self.run, name="word_highlighter.worker.{}".format(i), daemon=True)
+                self.threads.append(thread)
+                thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            for job in self.jobs.values():
+                job.cancel()
+            self.jobs.clear()
+            for job in self.running.values():
+                job.cancel()
+            self.condition.notify_all()
+            self.threads = []
+
+    def submit(self, job):
+        with self.condition:
+            self.cancel(job.job_key)
+            self.jobs[job.job_key] = job
+            self.condition.notify()
+
+    def cancel(self, key):
+        """Cancels the pending and the running job of the key"""
+        with self.condition:
+            previous = self.jobs.pop(key, None)
+            if previous is not None:
+                previous.cancel()
+            running = self.running.get(key)
+            if running is not None:
+                running.cancel()
+
+    def next_job(self):
+        """The first pending job of a key that has no running job, or None"""
+        for key in self.jobs:
+            if key not in self.running:
+                return self.jobs.pop(key)
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                job = None
+                while not self.stopped and threading.current_thread() in self.threads:
+                    job = self.next_job()
+                    if job is not None:
+                        break
+                    self.condition.wait()
+                # Also stop if the worker has been restarted with new threads
+                if job is None:
+                    return
+                self.running[job.job_key] = job
+            try:
+                job.run()
+            except Exception:
+                logger.exception("Scan of view %d failed", job.view.id())
+            finally:
+                with self.condition:
+                    self.running.pop(job.job_key, None)
+                    # A newer job of the key may be waiting for this one to finish
+                    self.condition.notify_all()
+
+worker = ScanWorker()
@@ -1,19 +1,35 @@
-from .src import helpers, commands, core
+from .src import helpers, commands, core, engine, occurrences, stats, worker
 
 def plugin_loaded():
     helpers.plugin_loaded()
     commands.plugin_loaded()
     core.plugin_loaded()
+    engine.plugin_loaded()
+    occurrences.plugin_loaded()
+    stats.plugin_loaded()
+    worker.plugin_loaded()
+
+def plugin_unloaded():
+    worker.plugin_unloaded()
+    occurrences.plugin_unloaded()
+    core.plugin_unloaded()
+    helpers.plugin_unloaded()
 
 from .src.commands import WordHighlighterUpdateHighlightsEvent
 from .src.commands import WordHighlighterUpdateColorSchemeEvent
 from .src.commands import WordHighlighterClearInstances
 from .src.commands import WordHighlighterClearMenu
 from .src.commands import WordHighlighterHighlightInstancesOfSelection
+from .src.commands import WordHighlighterHighlightInstancesOfSelectionInWindow
+from .src.commands import WordHighlighterClearWindowInstances
 from .src.commands import WordHighlighterEditRegexp
 from .src.commands import WordHighlighterCreateRegexp
 from .src.commands import WordHighlighterEditRegexpMenu
 from .src.commands import WordHighlighterWordColorMenu
+from .src.commands import WordHighlighterShowStats
+from .src.commands import WordHighlighterIndexProjectOccurrences
+from .src.commands import WordHighlighterGotoNext
+from .src.commands import WordHighlighterGotoPrevious
 
 # sublime_plugin classes must be exposed here (or at least on this level) to be registered in Sublime Text
 __all__ = [
@@ -22,8 +38,14 @@ __all__ = [
     "WordHighlighterClearInstances",
     "WordHighlighterClearMenu",
     "WordHighlighterHighlightInstancesOfSelection",
+    "WordHighlighterHighlightInstancesOfSelectionInWindow",
+    "WordHighlighterClearWindowInstances",
     "WordHighlighterEditRegexp",
     "WordHighlighterCreateRegexp",
     "WordHighlighterEditRegexpMenu",
     "WordHighlighterWordColorMenu",
+    "WordHighlighterShowStats",
+    "WordHighlighterIndexProjectOccurrences",
+    "WordHighlighterGotoNext",
+    "WordHighlighterGotoPrevious",
 ]
\ No newline at end of file
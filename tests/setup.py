@@ -1,9 +1,19 @@
 import unittest
+from unittest.mock import patch
 import sublime
 import word_highlighter.src.core as core
+import word_highlighter.src.worker as worker
+
+def run_scan_job(job):
+    """Runs a scan job and commits it right away, like an idle worker would before the test checks the highlights"""
+    with patch("sublime.set_timeout", side_effect=lambda callback, delay=0: callback()):
+        job.run()
 
 class SublimeText_TestCase(unittest.TestCase):
     def setUp(self):
+        submit_patcher = patch.object(worker.worker, "submit", side_effect=run_scan_job)
+        submit_patcher.start()
+        self.addCleanup(submit_patcher.stop)
         self.window = sublime.active_window()
         self.view = self.window.new_file()
         self.view.set_scratch(True)
@@ -6,7 +6,9 @@ plugin_loaded()
 
 import word_highlighter.src.commands as commands
 import word_highlighter.src.core as core
+import word_highlighter.src.engine as engine
 import word_highlighter.src.helpers as helpers
+import word_highlighter.src.worker as worker
 from word_highlighter.tests.setup import SublimeText_TestCase, WordHighlighter_TestCase
 
 def clip(min_val, val, max_val):
@@ -54,6 +56,16 @@ class TestHighlighting(SublimeText_TestCase):
                 self.error_list.append("'{}' - Error: '{}'".format(c,e))
         self.assertEqual([], self.error_list, "Non-highlightable characters: Errors for {}/{}".format(len(self.error_list), len(chars)))
 
+    def test_selection_is_highlighted_by_the_worker(self):
+        self.set_buffer("word1 word2")
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0, 5))
+        with patch.object(core.WordHighlightCollection, "update") as update_mock:
+            self.view.run_command("word_highlighter_highlight_instances_of_selection")
+        self.assertFalse(update_mock.called, "The UI thread does not scan")
+        self.assertTrue(worker.worker.submit.called)
+        self.assertEqual([[0, 5]], [region_to_list(r) for r in self.get_highlighted_regions()])
+
 class TestWordHighlighterClearMenu(WordHighlighter_TestCase, core.CollectionableMixin):
     def setUp(self):
         super(TestWordHighlighterClearMenu, self).setUp()
@@ -84,6 +96,18 @@ class TestWordHighlighterClearMenu(WordHighlighter_TestCase, core.Collectionable
             self.WordHighlighterClearMenu._run()
         self.assertEqual(4, len(mock_window_method.return_value.show_quick_panel.mock_calls))
 
+    def test_suspended_words_are_marked(self):
+        self.set_buffer("word1 word2")
+        self.collection._add_word(core.WordHighlight("word1"))
+        self.collection._add_word(core.WordHighlight("word2"))
+        self.save_collection()
+        engine.budget.suspend(self.view, "word2", 2.5, 10)
+        self.addCleanup(engine.budget.forget, self.view.buffer_id())
+        with patch.object(self.WordHighlighterClearMenu.view, "window") as mock_window_method:
+            self.WordHighlighterClearMenu._run()
+        items = mock_window_method.return_value.show_quick_panel.call_args[0][0]
+        self.assertEqual(["word1", "word2  [too slow: 2.5 s, 10 matches]"], items)
+
 class TestWordHighlighterEditRegexp(WordHighlighter_TestCase, core.CollectionableMixin):
     def setUp(self):
         super(TestWordHighlighterEditRegexp, self).setUp()
@@ -91,6 +115,8 @@ class TestWordHighlighterEditRegexp(WordHighlighter_TestCase, core.Collectionabl
         # Set collection to point out word
         self.set_buffer("word1 word2 word3")
         self.collection._add_word(core.WordHighlight("word1"))
+        # The words at the selection are looked up in the match index of the published update
+        self.collection.update()
         self.save_collection()
         self.WordHighlighterEditRegexp.load_collection()
         self.word = self.WordHighlighterEditRegexp.collection.words[0]
@@ -119,11 +145,20 @@ class TestWordHighlighterEditRegexp(WordHighlighter_TestCase, core.Collectionabl
         on_done(new_regex)
         self.assertEqual(0, len(self.WordHighlighterEditRegexp.collection.words))
 
-    def test_regex_is_set_on_modified(self):
+    def test_regex_is_only_previewed_on_modified(self):
         on_modified = self.WordHighlighterEditRegexp.create_on_modified(self.word)
-        new_regex = "word2"
-        on_modified(new_regex)
-        self.assertEqual(new_regex, self.word.get_regex())
+        old_regex = self.word.get_regex()
+        with patch("word_highlighter.src.core.RegexPreview") as preview_mock, patch.object(self.WordHighlighterEditRegexp.collection, "serialize") as serialize_mock:
+            on_modified("word2")
+        preview_mock.assert_called_once_with(self.WordHighlighterEditRegexp.collection, self.word, "word2")
+        self.assertTrue(preview_mock.return_value.start.called)
+        self.assertFalse(serialize_mock.called)
+        self.assertEqual(old_regex, self.word.get_regex())
+
+    def test_regex_is_set_on_done(self):
+        on_done = self.WordHighlighterEditRegexp.create_on_done(self.word)
+        on_done("word2")
+        self.assertEqual("word2", self.word.get_regex())
 
     def test_regex_is_reset_on_canceled(self):
         old_regex = self.word.get_regex()
@@ -132,6 +167,81 @@ class TestWordHighlighterEditRegexp(WordHighlighter_TestCase, core.Collectionabl
         on_canceled()
         self.assertEqual(old_regex, self.word.get_regex())
 
+class TestWordHighlighterGotoOccurrence(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestWordHighlighterGotoOccurrence, self).setUp()
+        self.set_buffer("word1 word2\nword1 word3\nword2 word1\n")
+        self.collection._add_word(core.WordHighlight("word1", match_by_word=True, literal_match=True))
+        self.collection._add_word(core.WordHighlight("word2", match_by_word=True, literal_match=True))
+        self.collection.save()
+        self.collection.update()
+        self.view.sel().clear()
+
+    def goto(self, command, point, **args):
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point, point))
+        command(self.view).run(None, **args)
+        return [self.view.sel()[0].begin(), self.view.sel()[0].end()]
+
+    def test_next_occurrence_of_highlight_under_cursor(self):
+        self.assertEqual([12, 17], self.goto(commands.WordHighlighterGotoNext, 1))
+        self.assertEqual([0, 5], self.goto(commands.WordHighlighterGotoNext, 31), "Wraps around")
+
+    def test_previous_occurrence_of_highlight_under_cursor(self):
+        self.assertEqual([30, 35], self.goto(commands.WordHighlighterGotoPrevious, 1), "Wraps around")
+        self.assertEqual([0, 5], self.goto(commands.WordHighlighterGotoPrevious, 13))
+
+    def test_next_occurrence_of_any_highlight(self):
+        self.assertEqual([6, 11], self.goto(commands.WordHighlighterGotoNext, 1, any_highlight=True))
+        self.assertEqual([24, 29], self.goto(commands.WordHighlighterGotoNext, 18))
+
+    def test_jump_does_not_scan(self):
+        with patch("word_highlighter.src.engine.scan_regions") as scan_regions_mock:
+            self.goto(commands.WordHighlighterGotoNext, 1)
+        self.assertFalse(scan_regions_mock.called)
+
+    def test_wraps_around_after_edits_in_several_windows(self):
+        self.set_buffer("word1 word2\n" + "line\n" * 20 + "word2 word1\n")
+        self.collection.update()
+        self.view.run_command("insert", {"characters": "x"})
+        dirty_regions = [sublime.Region(self.view.size() - 1, self.view.size())]
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0, 0))
+        self.view.run_command("insert", {"characters": "x "})
+        dirty_regions.append(sublime.Region(0, 2))
+        self.collection.update(dirty_regions)
+        self.assertEqual([2, 7], self.goto(commands.WordHighlighterGotoNext, self.view.size() - 4), "Wraps around")
+
+    def test_stays_near_the_visible_region_in_viewport_updates(self):
+        settings = {"viewport_update_size": 0}
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            self.collection.update()
+            with patch("sublime.status_message") as status_message_mock:
+                self.assertEqual([31, 31], self.goto(commands.WordHighlighterGotoNext, 31))
+        self.assertTrue(status_message_mock.called)
+
+    def test_waits_for_the_index(self):
+        self.view.sel().add(sublime.Region(self.view.size(), self.view.size()))
+        self.view.run_command("insert", {"characters": "x"})
+        with patch("sublime.status_message") as status_message_mock:
+            self.assertEqual([1, 1], self.goto(commands.WordHighlighterGotoNext, 1))
+        self.assertTrue(status_message_mock.called)
+
+class TestWordHighlighterUpdateHighlightsEvent(WordHighlighter_TestCase):
+    def test_reactivation_keeps_a_single_viewport_poller(self):
+        listener = commands.WordHighlighterUpdateHighlightsEvent(self.view)
+        with patch("sublime.set_timeout") as set_timeout_mock:
+            listener.on_activated()
+            listener.on_deactivated()
+            listener.on_activated()
+            for _ in range(3):
+                callbacks = [call[0][0] for call in set_timeout_mock.call_args_list]
+                set_timeout_mock.reset_mock()
+                for callback in callbacks:
+                    callback()
+                self.assertEqual(1, set_timeout_mock.call_count, "Only the latest polling goes on")
+
 class TestWordHighlighterCreateRegexp(WordHighlighter_TestCase, core.CollectionableMixin):
     def setUp(self):
         super(TestWordHighlighterCreateRegexp, self).setUp()
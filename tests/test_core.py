@@ -1,10 +1,15 @@
 import sublime
+import os
+import tempfile
+import unittest
 from unittest.mock import patch
 
 from word_highlighter.sublime_plugin import plugin_loaded
 plugin_loaded()
 
 import word_highlighter.src.core as core
+import word_highlighter.src.engine as engine
+import word_highlighter.src.worker as worker
 from word_highlighter.tests.setup import SublimeText_TestCase, WordHighlighter_TestCase
 
 class TestColorPickingSchemes(WordHighlighter_TestCase):
@@ -93,6 +98,35 @@ class TestColorPickingSchemes(WordHighlighter_TestCase):
         for scheme_string in core.color_schemes.keys():
             self.assertIs(core.color_schemes[scheme_string], core.get_color_picking_scheme(scheme_string))
 
+class TestColorSchemeCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = patch.object(core.ColorSchemeCache, "get_scheme_path", side_effect=lambda name: os.path.join(self.directory.name, name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.color_scheme = "Packages/Color Scheme - Default/Monokai.sublime-color-scheme"
+
+    def test_scheme_is_written_once(self):
+        cache = core.ColorSchemeCache()
+        self.assertTrue(cache.write_scheme(self.color_scheme))
+        for _ in range(100):
+            self.assertFalse(cache.write_scheme(self.color_scheme))
+
+    def test_identical_file_is_not_written_again(self):
+        core.ColorSchemeCache().write_scheme(self.color_scheme)
+        self.assertFalse(core.ColorSchemeCache().write_scheme(self.color_scheme))
+
+    def test_changed_file_is_written_again(self):
+        core.ColorSchemeCache().write_scheme(self.color_scheme)
+        with open(os.path.join(self.directory.name, "Monokai"), "w") as f:
+            f.write("{}")
+        self.assertTrue(core.ColorSchemeCache().write_scheme(self.color_scheme))
+
+    def test_variables_are_resolved(self):
+        self.assertEqual("#ff0000", core.lookup_color(" var( red ) ", {"red": "#ff0000"}))
+        self.assertEqual("#00ff00", core.lookup_color("#00ff00", {"red": "#ff0000"}))
+
 class TestCollection(WordHighlighter_TestCase):
     def test_toggle_word(self):
         word = core.WordHighlight("asd", match_by_word=False)
@@ -107,6 +141,70 @@ class TestCollection(WordHighlighter_TestCase):
         self.collection.clear()
         self.assertEqual([], self.collection.words)
 
+    def test_color_frequencies_follow_words(self):
+        words = [core.WordHighlight("word{}".format(i), color=core.SCOPE_COLORS[i % 2]) for i in range(3)]
+        for w in words:
+            self.collection._add_word(w)
+        self.collection._remove_word(words[0])
+        self.assertEqual([1, 1] + [0] * (self.color_count - 2), self.collection.color_frequencies())
+
+    def test_set_word_regex_keeps_order(self):
+        words = [core.WordHighlight("word{}".format(i)) for i in range(3)]
+        for w in words:
+            self.collection._add_word(w)
+        self.collection.set_word_regex(words[1], "other")
+        self.assertEqual(words, self.collection.words)
+        self.assertIs(words[1], self.collection.get_word_highlight(core.WordHighlight("other")))
+        self.assertFalse(self.collection.has_word(core.WordHighlight("word1")))
+
+    def test_set_word_regex_of_another_word(self):
+        words = [core.WordHighlight("word{}".format(i), color=core.SCOPE_COLORS[i]) for i in range(3)]
+        for w in words:
+            self.collection._add_word(w)
+        self.collection.set_word_regex(words[0], "word2")
+        self.assertEqual([words[0], words[1]], self.collection.words)
+        self.assertEqual([1, 1] + [0] * (self.color_count - 2), self.collection.color_frequencies())
+        # Removing the edited word must not leave the word it replaced behind
+        self.collection._remove_word(words[0])
+        self.assertEqual([words[1]], self.collection.words)
+
+    def test_unpickle_list_of_words(self):
+        word = core.WordHighlight("word1", color=core.SCOPE_COLORS[0])
+        collection = core.WordHighlightCollection.__new__(core.WordHighlightCollection)
+        collection.__setstate__({"words": [word], "view": self.view, "color_index": 1, "removed_words": []})
+        self.assertEqual([word], collection.words)
+        self.assertTrue(collection.has_word(word))
+        self.assertEqual(1, collection.color_frequencies()[0])
+
+class TestWindowHighlightSet(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestWindowHighlightSet, self).setUp()
+        self.window_set = core.WindowHighlightSet()
+        self.word = core.WordHighlight("word1", color=core.SCOPE_COLORS[1], match_by_word=True, literal_match=True)
+
+    def test_apply_adds_copy_of_word(self):
+        self.window_set.toggle_word(self.word)
+        self.assertTrue(self.window_set.apply(self.collection))
+        self.assertTrue(self.collection.has_word(self.word))
+        self.assertIsNot(self.word, self.collection.get_word_highlight(self.word))
+        self.assertEqual(self.word.get_key(), self.collection.get_word_highlight(self.word).get_key())
+        self.assertFalse(self.window_set.apply(self.collection), "Applying again changes nothing")
+
+    def test_apply_removes_words_removed_from_set(self):
+        self.window_set.toggle_word(self.word)
+        self.window_set.apply(self.collection)
+        self.window_set.toggle_word(self.word)
+        self.assertTrue(self.window_set.apply(self.collection))
+        self.assertFalse(self.collection.has_word(self.word))
+
+    def test_words_of_the_view_are_kept(self):
+        self.collection._add_word(core.WordHighlight("word1", match_by_word=True, literal_match=True))
+        self.window_set.toggle_word(self.word)
+        self.window_set.apply(self.collection)
+        self.window_set.clear()
+        self.window_set.apply(self.collection)
+        self.assertTrue(self.collection.has_word(self.word))
+
 class TestExpandToWordSimple(SublimeText_TestCase):
     def test_start_of_word(self):
         self.set_buffer("word")
@@ -156,3 +254,332 @@ class TestRestoreCollection(SublimeText_TestCase):
         self.assertIsInstance(word, core.WordHighlight)
         self.assertEqual(self.scope_name, word.get_scope())
         self.assertEqual(self.key_name, word.get_key())
+
+    def test_each_text_is_classified_once(self):
+        self.set_buffer("word word other word")
+        self.view.add_regions(self.key_name, [sublime.Region(0,4), sublime.Region(5,9), sublime.Region(10,15), sublime.Region(16,20)], self.scope_name)
+        with patch("word_highlighter.src.core.expand_to_word", wraps=core.expand_to_word) as expand_to_word_mock:
+            collection = core.WordHighlightCollection.restore(self.view)
+        self.assertEqual(2, expand_to_word_mock.call_count)
+        self.assertEqual(["\\bword\\b", "\\bother\\b"], [w.get_regex() for w in collection.words])
+
+class TestIncrementalUpdate(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestIncrementalUpdate, self).setUp()
+        self.set_buffer("word1 word2\nword1 word3\nword2 word1\n")
+        self.collection._add_word(core.WordHighlight("word1", match_by_word=True, literal_match=True))
+        self.collection._add_word(core.WordHighlight("word2", match_by_word=True, literal_match=True))
+        self.collection.update()
+
+    def get_highlighted_regions(self):
+        return {k: [[r.begin(), r.end()] for r in self.view.get_regions(k)] for k in core.SCOPE_COLORS}
+
+    def insert(self, point, characters):
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point, point))
+        self.view.run_command("insert", {"characters": characters})
+        return sublime.Region(point, point + len(characters))
+
+    def test_same_as_full_update(self):
+        dirty_regions = [self.insert(12, "word2 "), self.insert(0, "\n")]
+        self.collection.update(dirty_regions)
+        incremental = self.get_highlighted_regions()
+        self.collection.published = None
+        self.collection.update(dirty_regions)
+        self.assertEqual(self.get_highlighted_regions(), incremental)
+
+    def test_full_update_when_words_changed(self):
+        dirty_regions = [self.insert(0, "word3 ")]
+        self.collection._add_word(core.WordHighlight("word3", match_by_word=True, literal_match=True))
+        with patch.object(self.collection, "get_dirty_windows") as get_dirty_windows_mock:
+            self.collection.update(dirty_regions)
+        self.assertFalse(get_dirty_windows_mock.called)
+
+    def test_index_is_spliced_after_edit(self):
+        dirty_regions = [self.insert(12, "word2 ")]
+        with patch.object(worker.IndexJob, "run") as run_mock:
+            self.collection.update(dirty_regions)
+        self.assertFalse(run_mock.called, "The index is derived from the previous one")
+        self.assertEqual(sublime.Region(18, 23), self.collection.get_match_index().next_after(12, "\\bword1\\b"))
+
+    def test_index_covers_the_whole_buffer_after_edits_in_several_windows(self):
+        self.set_buffer("word1\n" * 20)
+        self.collection.update()
+        dirty_regions = [self.insert(0, "x "), self.insert(self.view.size(), "word1")]
+        self.assertEqual(2, len(self.collection.get_dirty_windows(dirty_regions)))
+        self.collection.update(dirty_regions)
+        index = self.collection.get_match_index()
+        self.assertIsNone(index.window)
+        self.assertEqual(21, len(index.begins))
+
+    def test_text_after_the_cursor_is_dirty(self):
+        # An auto-paired bracket leaves the cursor between the brackets
+        self.set_buffer("word1()")
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(6, 6))
+        dirty_regions = core.DirtyRegions(self.view)
+        self.addCleanup(dirty_regions.clear)
+        dirty_regions.add_edit("insert", {"characters": "("}, 2)
+        self.assertTrue(any(r.contains(sublime.Region(5, 7)) for r in dirty_regions.get()))
+
+class TestRegionPublisher(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestRegionPublisher, self).setUp()
+        self.set_buffer("word1 word2 word3\n" * 10)
+        self.collection._add_word(core.WordHighlight("word1", match_by_word=True, literal_match=True))
+        self.collection._add_word(core.WordHighlight("word2", match_by_word=True, literal_match=True))
+        self.collection.update()
+        self.word = core.WordHighlight("word3", match_by_word=True, literal_match=True)
+
+    def tearDown(self):
+        core.forget_collection(self.view)
+        super(TestRegionPublisher, self).tearDown()
+
+    def get_published_keys(self):
+        with patch.object(self.view, "add_regions") as add_regions_mock, patch.object(self.view, "erase_regions") as erase_regions_mock:
+            self.collection.update()
+        return [c[0][0] for c in add_regions_mock.call_args_list + erase_regions_mock.call_args_list]
+
+    def test_unchanged_update_publishes_nothing(self):
+        self.assertEqual([], self.get_published_keys())
+
+    def test_toggle_word_publishes_its_key(self):
+        self.collection.toggle_word(self.word)
+        self.assertEqual([self.word.get_key()], self.get_published_keys())
+        self.collection.toggle_word(self.word)
+        self.assertEqual([self.word.get_key()], self.get_published_keys())
+
+    def test_edit_publishes_all_keys(self):
+        self.set_buffer("word2 word1")
+        self.assertEqual(2, len(self.get_published_keys()))
+
+class TestCachedUpdate(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestCachedUpdate, self).setUp()
+        self.set_buffer("word1 word2\nword1 word3\nword2 word1\n")
+        self.word = core.WordHighlight("word1", match_by_word=True, literal_match=True)
+        self.collection._add_word(self.word)
+        self.collection._add_word(core.WordHighlight("word2", match_by_word=True, literal_match=True))
+        self.collection.update()
+
+    def tearDown(self):
+        core.forget_collection(self.view)
+        engine.forget_snapshot(self.view)
+        super(TestCachedUpdate, self).tearDown()
+
+    def update_scanned_regexes(self, dirty_regions=None):
+        with patch("word_highlighter.src.engine.scan_regions", wraps=engine.scan_regions) as scan_regions_mock:
+            self.collection.update(dirty_regions)
+        return [[w.get_regex() for w in c[0][1]] for c in scan_regions_mock.call_args_list]
+
+    def change_color(self):
+        self.collection._remove_word(self.word)
+        self.word.set_color(core.ColorType(core.SCOPE_COLORS[-1]))
+        self.collection._add_word(self.word)
+
+    def test_color_change_does_not_scan(self):
+        self.change_color()
+        self.assertEqual([], self.update_scanned_regexes())
+        self.assertEqual([[0, 5], [12, 17], [30, 35]], [[r.begin(), r.end()] for r in self.view.get_regions(self.word.get_key())])
+
+    def test_added_word_is_scanned_alone(self):
+        self.collection._add_word(core.WordHighlight("word3", match_by_word=True, literal_match=True))
+        self.assertEqual([["\\bword3\\b"]], self.update_scanned_regexes())
+
+    def test_words_at_cursors_do_not_scan(self):
+        regions = [sublime.Region(1, 2), sublime.Region(5, 6), sublime.Region(12, 18)]
+        with patch("word_highlighter.src.engine.scan_regions") as scan_regions_mock:
+            words_at = self.collection.get_words_at(regions)
+        self.assertFalse(scan_regions_mock.called)
+        self.assertEqual([[("\\bword1\\b", [0, 5])], [], [("\\bword1\\b", [12, 17])]], [[(w.get_regex(), [m.begin(), m.end()]) for w, m in hits] for hits in words_at])
+
+    def test_color_change_after_edit_does_not_scan(self):
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(12, 12))
+        self.view.run_command("insert", {"characters": "word2 "})
+        self.collection.update([sublime.Region(12, 18)])
+        self.change_color()
+        self.assertEqual([], self.update_scanned_regexes())
+        self.assertEqual([[0, 5], [18, 23], [36, 41]], [[r.begin(), r.end()] for r in self.view.get_regions(self.word.get_key())])
+
+class TestProgressiveUpdate(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestProgressiveUpdate, self).setUp()
+        self.set_buffer("word1 word2\n" * 1000)
+        self.word = core.WordHighlight("word1", match_by_word=True, literal_match=True)
+        self.collection._add_word(self.word)
+
+    def tearDown(self):
+        core.ProgressiveUpdate.cancel(self.view)
+        super(TestProgressiveUpdate, self).tearDown()
+
+    def test_split_into_chunks(self):
+        chunks = core.ProgressiveUpdate(self.view, [self.word]).split_into_chunks(100)
+        self.assertEqual(0, chunks[0].begin())
+        self.assertEqual(self.view.size(), chunks[-1].end())
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(previous.end() + 1, chunk.begin(), "Chunks are separated by a newline")
+            self.assertEqual(self.view.line(chunk.begin()).begin(), chunk.begin(), "Chunks start at a line")
+
+    def test_visible_region_is_highlighted_first(self):
+        # Without a time box, only the first chunk is scanned before it is published
+        settings = {"progressive_update_size": 0, "progressive_chunk_size": 100, "progressive_time_box": 0}
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            with patch("sublime.set_timeout_async"):
+                self.collection.update()
+        visible = self.view.visible_region()
+        regions = self.view.get_regions(self.word.get_key())
+        self.assertTrue(any(visible.contains(r) for r in regions))
+        self.assertLess(len(regions), 1000, "The rest of the buffer is scanned later")
+
+    def test_words_at_cursor_wait_for_the_update(self):
+        settings = {"progressive_update_size": 0, "progressive_chunk_size": 100, "progressive_time_box": 0}
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            with patch("sublime.set_timeout_async"):
+                self.collection.update()
+            with patch("word_highlighter.src.engine.scan_regions") as scan_regions_mock:
+                words_at = self.collection.get_words_at([sublime.Region(1, 2)])
+        self.assertEqual([[]], words_at)
+        self.assertFalse(scan_regions_mock.called, "The buffer is not scanned on the UI thread")
+
+    def test_completed_update_indexes_the_whole_buffer(self):
+        settings = {"progressive_update_size": 0, "progressive_chunk_size": 1000, "progressive_time_box": 0}
+        run = lambda callback, delay=0: callback()
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            with patch("sublime.set_timeout", side_effect=run), patch("sublime.set_timeout_async", side_effect=run):
+                self.collection.update()
+        index = self.collection.get_match_index()
+        self.assertIsNone(index.window)
+        self.assertEqual(1000, len(index.begins))
+        self.assertEqual([[(self.word, sublime.Region(0, 5))]], self.collection.get_words_at([sublime.Region(1, 2)]))
+
+    def test_color_change_after_completed_update_does_not_scan(self):
+        settings = {"progressive_update_size": 0, "progressive_chunk_size": 1000, "progressive_time_box": 0}
+        run = lambda callback, delay=0: callback()
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            with patch("sublime.set_timeout", side_effect=run), patch("sublime.set_timeout_async", side_effect=run):
+                self.collection.update()
+            self.assertEqual(1000, len(self.view.get_regions(self.word.get_key())))
+            self.collection._remove_word(self.word)
+            self.word.set_color(core.ColorType(core.SCOPE_COLORS[-1]))
+            self.collection._add_word(self.word)
+            with patch("word_highlighter.src.engine.scan_regions", wraps=engine.scan_regions) as scan_regions_mock:
+                with patch.object(core.ProgressiveUpdate, "start") as start_mock:
+                    self.collection.update()
+        self.assertFalse(scan_regions_mock.called)
+        self.assertFalse(start_mock.called, "The cached matches of the whole buffer are published at once")
+        self.assertEqual(1000, len(self.view.get_regions(self.word.get_key())))
+
+class TestRegexPreview(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestRegexPreview, self).setUp()
+        self.set_buffer("word1 word2\nword1 word3\n")
+        self.word = core.WordHighlight("word1", match_by_word=True, literal_match=True)
+        self.collection._add_word(self.word)
+        self.collection.update()
+
+    def tearDown(self):
+        core.RegexPreview.stop(self.view)
+        super(TestRegexPreview, self).tearDown()
+
+    def run_preview(self, regex):
+        preview = core.RegexPreview(self.collection, self.word, regex)
+        core.RegexPreview.running[self.view.id()] = preview
+        with patch("sublime.set_timeout") as set_timeout_mock:
+            preview.run()
+        for call in set_timeout_mock.call_args_list:
+            call[0][0]()
+        return [[r.begin(), r.end()] for r in self.view.get_regions(core.RegexPreview.key)]
+
+    def test_preview_shows_matches(self):
+        self.assertEqual([[18, 23]], self.run_preview("word3"))
+
+    def test_invalid_regex_is_not_scanned(self):
+        with patch("word_highlighter.src.engine.scan_regions") as scan_regions_mock:
+            self.assertEqual([], self.run_preview("word("))
+        self.assertFalse(scan_regions_mock.called)
+
+    def test_cancelled_preview_is_not_published(self):
+        preview = core.RegexPreview(self.collection, self.word, "word3")
+        preview.cancelled = True
+        with patch("sublime.set_timeout") as set_timeout_mock:
+            preview.run()
+        self.assertFalse(set_timeout_mock.called)
+
+    def test_preview_hides_the_word(self):
+        with patch.object(worker.worker, "submit"):
+            core.RegexPreview(self.collection, self.word, "word3").start()
+        self.assertEqual([], self.view.get_regions(self.word.get_key()))
+
+    def test_newer_preview_replaces_pending_preview(self):
+        scan_worker = worker.ScanWorker()
+        with patch.object(worker, "worker", scan_worker):
+            first = core.RegexPreview(self.collection, self.word, "word2")
+            first.start()
+            second = core.RegexPreview(self.collection, self.word, "word3")
+            second.start()
+            self.assertTrue(first.cancelled)
+            self.assertEqual([second], list(scan_worker.jobs.values()))
+            core.RegexPreview.stop(self.view)
+        self.assertTrue(second.cancelled)
+        self.assertEqual([], list(scan_worker.jobs.values()))
+
+    def test_preview_does_not_replace_the_scan(self):
+        scan_worker = worker.ScanWorker()
+        job = worker.ScanJob(self.collection)
+        scan_worker.submit(job)
+        with patch.object(worker, "worker", scan_worker):
+            core.RegexPreview(self.collection, self.word, "word3").start()
+        self.assertFalse(job.cancelled)
+        self.assertEqual(2, len(scan_worker.jobs))
+
+class TestViewportUpdate(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestViewportUpdate, self).setUp()
+        self.set_buffer("word1 word2\n" * 1000)
+        self.word = core.WordHighlight("word1", match_by_word=True, literal_match=True)
+        self.collection._add_word(self.word)
+
+    def tearDown(self):
+        core.forget_collection(self.view)
+        super(TestViewportUpdate, self).tearDown()
+
+    def update(self):
+        settings = {"viewport_update_size": 0, "viewport_margin_lines": 0}
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.side_effect = lambda key, default=None: settings.get(key, default)
+            self.collection.update()
+
+    def test_only_visible_region_is_highlighted(self):
+        self.update()
+        window = core.get_viewport_window(self.view, 0)
+        regions = self.view.get_regions(self.word.get_key())
+        self.assertTrue(regions)
+        self.assertTrue(all(window.contains(r) for r in regions))
+        self.assertLess(len(regions), 1000)
+
+    def test_viewport_is_not_a_base_for_incremental_updates(self):
+        self.update()
+        self.assertIsNone(self.collection.published)
+        self.assertEqual(core.get_viewport_window(self.view, 0), core.get_publisher(self.view).viewport)
+
+class TestCollectionRegistry(WordHighlighter_TestCase):
+    def tearDown(self):
+        core.forget_collection(self.view)
+        super(TestCollectionRegistry, self).tearDown()
+
+    def test_load_shares_saved_collection(self):
+        self.assertIs(self.collection, core.WordHighlightCollection.load(self.view))
+
+    def test_load_deserializes_forgotten_collection(self):
+        self.collection._add_word(core.WordHighlight("word1"))
+        core.serialize_collection(self.view)
+        core.forget_collection(self.view)
+        collection = core.WordHighlightCollection.load(self.view)
+        self.assertIsNot(self.collection, collection)
+        self.assertEqual(["word1"], [w.get_regex() for w in collection.words])
+        self.assertEqual(self.view.id(), collection.view.id())
@@ -0,0 +1,267 @@
+import sublime
+import unittest
+from unittest.mock import MagicMock, patch
+import re
+
+from word_highlighter.sublime_plugin import plugin_loaded
+plugin_loaded()
+
+import word_highlighter.src.core as core
+import word_highlighter.src.engine as engine
+from word_highlighter.tests.setup import SublimeText_TestCase
+
+def regions_to_lists(regions):
+    return [[r.begin(), r.end()] for r in regions]
+
+class TestCombinedScan(SublimeText_TestCase):
+    def setUp(self):
+        super(TestCombinedScan, self).setUp()
+        self.set_buffer("foo bar foobar foo_bar bar.foo fo")
+        self.words = [core.WordHighlight(w, match_by_word=True, literal_match=True) for w in ["foo", "bar", "foobar", "fo"]]
+
+    def test_is_combinable(self):
+        self.assertTrue(all(engine.is_combinable(w) for w in self.words))
+        self.assertFalse(engine.is_combinable(core.WordHighlight("foo", literal_match=True)), "Not matched by word")
+        self.assertFalse(engine.is_combinable(core.WordHighlight("foo.bar", match_by_word=True, literal_match=True)), "Not only word characters")
+        self.assertFalse(engine.is_combinable(core.WordHighlight("fo+", match_by_word=True)), "Not a literal")
+        self.assertFalse(engine.is_combinable(core.WordHighlight("foo\n", match_by_word=True, literal_match=True)), "Ends with a newline")
+
+    def test_custom_regex_is_not_combinable(self):
+        word = self.words[0]
+        word.set_regex("fo+")
+        self.assertFalse(engine.is_combinable(word))
+
+    def test_same_regions_as_find_all(self):
+        regions = engine.find_all_regions(self.view, self.words)
+        for w in self.words:
+            self.assertEqual(regions_to_lists(self.view.find_all(w.get_regex())), regions_to_lists(regions[w.get_regex()]), "Regions of {}".format(w))
+
+    def test_fallback_for_regex(self):
+        words = self.words + [core.WordHighlight("o+b")]
+        regions = engine.find_all_regions(self.view, words)
+        self.assertEqual(regions_to_lists(self.view.find_all("o+b")), regions_to_lists(regions["o+b"]))
+
+class TestSnapshotMatching(SublimeText_TestCase):
+    def tearDown(self):
+        engine.forget_snapshot(self.view)
+        super(TestSnapshotMatching, self).tearDown()
+
+    def test_snapshot_is_read_once_per_change(self):
+        self.set_buffer("word1 word2")
+        self.assertEqual("word1 word2", engine.get_snapshot(self.view))
+        self.assertEqual("word1 word2", engine.get_cached_snapshot(self.view))
+        self.set_buffer("word3")
+        self.assertIsNone(engine.get_cached_snapshot(self.view))
+        self.assertEqual("word3", engine.get_snapshot(self.view))
+
+    def test_literals_match_like_find_all(self):
+        chars = [chr(i) for i in range(0x20, 0x7f)] + ['\n']
+        self.set_buffer("".join(chars) * 2)
+        for c in chars:
+            for match_by_word in (False, True):
+                word = core.WordHighlight(c, literal_match=True, match_by_word=match_by_word)
+                self.assertEqual(regions_to_lists(self.view.find_all(word.get_regex())), regions_to_lists(word.find_all_regions(self.view)), "Regions of {}".format(repr(c)))
+
+    def test_line_anchors_match_like_find_all(self):
+        self.set_buffer("word1\nword2 word1\n")
+        for regex in ["^word", "word\\d$", "^$"]:
+            word = core.WordHighlight(regex)
+            self.assertEqual(regions_to_lists(self.view.find_all(regex)), regions_to_lists(word.find_all_regions(self.view)), "Regions of {}".format(regex))
+
+class TestMatchCache(SublimeText_TestCase):
+    def setUp(self):
+        super(TestMatchCache, self).setUp()
+        self.words = [core.WordHighlight(w, match_by_word=True, literal_match=True) for w in ["word1", "word2"]]
+
+    def tearDown(self):
+        engine.forget_snapshot(self.view)
+        super(TestMatchCache, self).tearDown()
+
+    def test_matches_are_reused_until_the_buffer_changes(self):
+        self.set_buffer("word1 word2 word1")
+        regex = self.words[0].get_regex()
+        first = engine.find_all_regions(self.view, self.words)
+        self.assertIs(first[regex], engine.find_all_regions(self.view, self.words[:1])[regex])
+        self.set_buffer("word2 word1")
+        second = engine.find_all_regions(self.view, self.words)
+        self.assertIsNot(first[regex], second[regex])
+        self.assertEqual([[6, 11]], regions_to_lists(second[regex]))
+
+    def test_windows_are_cached_separately(self):
+        self.set_buffer("word1 word2 word1")
+        whole = engine.find_all_regions(self.view, self.words)
+        window = engine.find_all_regions(self.view, self.words, sublime.Region(6, 17))
+        regex = self.words[0].get_regex()
+        self.assertEqual([[0, 5], [12, 17]], regions_to_lists(whole[regex]))
+        self.assertEqual([[12, 17]], regions_to_lists(window[regex]))
+
+    def test_matches_are_kept_while_the_buffer_is_open_in_another_view(self):
+        self.set_buffer("word1 word2 word1")
+        regex = self.words[0].get_regex()
+        first = engine.find_all_regions(self.view, self.words)
+        clone = MagicMock()
+        clone.buffer_id.return_value = self.view.buffer_id()
+        window = MagicMock()
+        window.views.return_value = [self.view, clone]
+        with patch.object(sublime, "windows", return_value=[window]):
+            engine.forget_closed_buffer(self.view, self.view.buffer_id())
+            self.assertIs(first[regex], engine.find_all_regions(self.view, self.words)[regex], "A clone is still open")
+            window.views.return_value = [self.view]
+            engine.forget_closed_buffer(self.view, self.view.buffer_id())
+            self.assertIsNot(first[regex], engine.find_all_regions(self.view, self.words)[regex], "The last view is closed")
+
+    def test_older_change_count_is_not_cached(self):
+        self.set_buffer("word1")
+        cache = engine.MatchCache()
+        change_count = self.view.change_count()
+        buffer_id = self.view.buffer_id()
+        cache.put(buffer_id, change_count, self.view.size(), "word1", None, engine.Matches())
+        cache.put(buffer_id, change_count - 1, self.view.size(), "word2", None, engine.Matches())
+        self.assertIsNotNone(cache.get(buffer_id, change_count, "word1"))
+        self.assertIsNone(cache.get(buffer_id, change_count, "word2"))
+        self.assertIsNone(cache.get(buffer_id, change_count - 1, "word2"))
+
+class TestPatternBudget(SublimeText_TestCase):
+    def setUp(self):
+        super(TestPatternBudget, self).setUp()
+        self.set_buffer("word1 " * 100)
+        self.words = [core.WordHighlight("word1", match_by_word=True, literal_match=True), core.WordHighlight("\\w")]
+
+    def tearDown(self):
+        engine.forget_snapshot(self.view)
+        super(TestPatternBudget, self).tearDown()
+
+    def find_all_regions(self, max_matches):
+        with patch.object(engine.PatternBudget, "get_limits", return_value=(10.0, max_matches)):
+            return engine.find_all_regions(self.view, self.words)
+
+    def test_regex_over_budget_is_suspended(self):
+        found = self.find_all_regions(200)
+        self.assertEqual(0, len(found["\\w"]))
+        self.assertEqual(100, len(found[self.words[0].get_regex()]))
+        self.assertTrue(engine.budget.is_suspended(self.view.buffer_id(), "\\w"))
+        self.assertFalse(engine.budget.is_suspended(self.view.buffer_id(), self.words[0].get_regex()))
+
+    def test_suspended_regex_is_not_scanned_again(self):
+        self.find_all_regions(200)
+        with patch.object(engine, "find_regions") as find_regions_mock:
+            engine.find_all_regions(self.view, self.words[1:])
+        self.assertFalse(find_regions_mock.called)
+
+    def test_resumed_regex_is_scanned(self):
+        self.find_all_regions(200)
+        engine.budget.resume(self.view, "\\w")
+        self.assertEqual(500, len(self.find_all_regions(1000)["\\w"]))
+
+class TestSpliceMatches(unittest.TestCase):
+    def test_window_is_replaced_and_tail_is_moved(self):
+        matches = engine.Matches.from_regions([sublime.Region(0, 2), sublime.Region(5, 7), sublime.Region(10, 12)])
+        window = engine.Matches.from_regions([sublime.Region(4, 6), sublime.Region(8, 9)])
+        spliced = engine.splice_matches(matches, 3, 8, 2, window)
+        self.assertEqual([[0, 2], [4, 6], [8, 9], [12, 14]], regions_to_lists(spliced))
+        self.assertEqual([[0, 2], [5, 7], [10, 12]], regions_to_lists(matches), "The cached matches are not modified")
+
+class TestMatchIndex(unittest.TestCase):
+    def setUp(self):
+        found = {
+            "word1": engine.Matches.from_regions([sublime.Region(0, 20), sublime.Region(30, 35)]),
+            "word2": engine.Matches.from_regions([sublime.Region(5, 10), sublime.Region(12, 14), sublime.Region(25, 26)]),
+        }
+        self.index = engine.MatchIndex.build(["word1", "word2"], found, 1, 40)
+
+    def regexes_at(self, begin, end, index=None):
+        index = self.index if index is None else index
+        return [(regex, [r.begin(), r.end()]) for regex, r in index.regexes_at(begin, end)]
+
+    def test_overlapping_matches_of_each_regex(self):
+        self.assertEqual([("word1", [0, 20]), ("word2", [12, 14])], self.regexes_at(11, 13))
+        self.assertEqual([("word1", [0, 20]), ("word2", [5, 10])], self.regexes_at(0, 20), "The first match of each regex")
+        self.assertEqual([("word1", [30, 35])], self.regexes_at(29, 31))
+
+    def test_no_overlapping_match(self):
+        self.assertEqual([], self.regexes_at(20, 25))
+        self.assertEqual([], self.regexes_at(35, 40))
+
+    def test_next_and_previous_of_any_regex(self):
+        self.assertEqual(sublime.Region(5, 10), self.index.next_after(0))
+        self.assertEqual(sublime.Region(25, 26), self.index.previous_before(30))
+        self.assertIsNone(self.index.next_after(30))
+
+    def test_next_and_previous_of_one_regex(self):
+        self.assertEqual(sublime.Region(30, 35), self.index.next_after(0, "word1"))
+        self.assertEqual(sublime.Region(12, 14), self.index.previous_before(25, "word2"))
+
+    def test_splice_replaces_window_and_moves_tail(self):
+        window_found = {"word1": engine.Matches(), "word2": engine.Matches.from_regions([sublime.Region(21, 23)])}
+        spliced = self.index.splice(sublime.Region(20, 28), window_found, 2, 42)
+        self.assertEqual(2, spliced.change_count)
+        self.assertEqual(sublime.Region(21, 23), spliced.next_after(14, "word2"))
+        self.assertEqual(sublime.Region(32, 37), spliced.next_after(23))
+        self.assertEqual([("word1", [32, 37])], self.regexes_at(32, 33, spliced))
+        self.assertEqual(sublime.Region(25, 26), self.index.next_after(14, "word2"), "The previous index is not modified")
+
+    def test_splice_of_edits_outside_the_window(self):
+        self.assertIsNone(self.index.splice(sublime.Region(20, 21), {"word1": engine.Matches(), "word2": engine.Matches()}, 2, 42))
+
+class TestPatternCache(unittest.TestCase):
+    def test_invalid_pattern(self):
+        self.assertIsNone(engine.PatternCache().get("("))
+
+    def test_horizontal_space_is_left_to_sublime(self):
+        self.assertIsNone(engine.PatternCache().get("a\\hb"))
+
+    def test_end_of_text_is_left_to_sublime(self):
+        self.assertIsNone(engine.PatternCache().get("word\\z"))
+
+    def test_unicode_property_is_left_to_sublime(self):
+        self.assertIsNone(engine.PatternCache().get("\\p{L}+"))
+
+    def test_posix_class_is_left_to_sublime(self):
+        self.assertIsNone(engine.PatternCache().get("[[:alpha:]]+"))
+
+    def test_inline_flags_after_the_start_are_left_to_sublime(self):
+        self.assertIsNone(engine.PatternCache().get("Word(?i)word"))
+        self.assertIsNotNone(engine.PatternCache().get("(?i)word"))
+
+    def test_escaped_backslash_is_not_an_escape(self):
+        self.assertIsNotNone(engine.PatternCache().get("a\\\\h\\[:alpha:]"))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = engine.PatternCache(max_size=2)
+        first = cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        self.assertIs(first, cache.get("a"))
+        self.assertNotIn(("b", engine.REGEX_FLAGS), cache.patterns)
+
+    def test_set_regex_invalidates(self):
+        word = core.WordHighlight("word_highlighter_test_regex")
+        engine.patterns.get(word.get_regex())
+        word.set_regex("other")
+        self.assertNotIn(("word_highlighter_test_regex", engine.REGEX_FLAGS), engine.patterns.patterns)
+
+class TestForeignSyntax(SublimeText_TestCase):
+    def test_sublime_finds_foreign_syntax(self):
+        self.set_buffer("a b\ta")
+        word = core.WordHighlight("a\\hb")
+        with patch.object(self.view, "find_all", return_value=[sublime.Region(0, 3)]) as find_all_mock:
+            found = engine.scan_regions(self.view, [word])
+        find_all_mock.assert_called_once_with("a\\hb")
+        self.assertEqual([[0, 3]], regions_to_lists(found["a\\hb"]))
+
+class TestLiteralMatcher(SublimeText_TestCase):
+    def test_overlapping_literals(self):
+        literals = ["aa", "a", "ab", "b", "aab", "a a"]
+        text = "aaabaab a a"
+        occurrences = engine.LiteralMatcher(literals).find_all(text, 0, len(text))
+        for literal in literals:
+            self.assertEqual(regions_to_lists(sublime.Region(b, e) for b, e in occurrences.get(literal, [])), regions_to_lists(sublime.Region(m.start(), m.end()) for m in re.finditer(re.escape(literal), text)), "Occurrences of '{}'".format(literal))
+
+    def test_same_regions_as_find_all(self):
+        self.set_buffer("ERR-1 ERR-12 ERR-123 (ERR-1) x.y x.y.z\n" * 10)
+        literals = ["ERR-{}".format(i) for i in range(engine.LITERAL_MATCHER_MIN_LITERALS)] + ["(ERR-1)", "x.y", ".y.", "\nE"]
+        words = [core.WordHighlight(l, literal_match=True) for l in literals]
+        regions = engine.find_all_regions(self.view, words)
+        for w in words:
+            self.assertEqual(regions_to_lists(self.view.find_all(w.get_regex())), regions_to_lists(regions[w.get_regex()]), "Regions of {}".format(w))
@@ -6,3 +6,16 @@ from word_highlighter.sublime_plugin import plugin_loaded
 plugin_loaded()
 
 import word_highlighter.src.helpers as helpers
+import logging
+from unittest.mock import patch
+
+class TestLogger(unittest.TestCase):
+    def test_logger_is_named_after_calling_module(self):
+        self.assertEqual("test_helpers", helpers.get_logger().name)
+
+    def test_log_level_from_settings(self):
+        with patch("word_highlighter.src.helpers.get_settings") as get_settings_mock:
+            get_settings_mock.return_value.get.return_value = "warning"
+            self.assertEqual(logging.WARNING, helpers.get_log_level())
+            get_settings_mock.return_value.get.return_value = "verbose"
+            self.assertEqual(logging.INFO, helpers.get_log_level())
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from word_highlighter.sublime_plugin import plugin_loaded
+plugin_loaded()
+
+import word_highlighter.src.core as core
+import word_highlighter.src.occurrences as occurrences
+
+def get_patterns(words):
+    return [(w.get_regex(), occurrences.get_pattern(w.get_regex())) for w in words]
+
+class TestScanFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.words = [core.WordHighlight(w, match_by_word=True, literal_match=True) for w in ["word1", "word2"]]
+
+    def write(self, name, contents):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def test_lines_and_counts(self):
+        path = self.write("a.txt", b"word1 word2\nword1 word1\n\nword22 word2")
+        hits = occurrences.scan_file(path, get_patterns(self.words))
+        self.assertEqual({"\\bword1\\b": [(1, 1), (2, 2)], "\\bword2\\b": [(1, 1), (4, 1)]}, hits)
+
+    def test_non_ascii_words(self):
+        words = [core.WordHighlight(w, match_by_word=True, literal_match=True) for w in ["café", "naïve"]]
+        path = self.write("a.txt", "un café\nnaïve cafés\n".encode("utf-8"))
+        self.assertEqual({"\\bcafé\\b": [(1, 1)], "\\bnaïve\\b": [(2, 1)]}, occurrences.scan_file(path, get_patterns(words)))
+
+    def test_lines_are_counted_across_chunks(self):
+        data = b"word1\n" * 10 + b"x word1"
+        chunks = list(occurrences.iterate_chunks(data, chunk_size=16))
+        self.assertTrue(all(c.endswith("\n") for c in chunks[:-1]))
+        hits = occurrences.find_lines(chunks, get_patterns(self.words))
+        self.assertEqual([(i, 1) for i in range(1, 12)], hits["\\bword1\\b"])
+
+    def test_no_hits(self):
+        self.assertIsNone(occurrences.scan_file(self.write("a.txt", b"other"), get_patterns(self.words)))
+        self.assertIsNone(occurrences.scan_file(self.write("empty.txt", b""), get_patterns(self.words)))
+        self.assertIsNone(occurrences.scan_file(self.write("binary.bin", b"word1\0"), get_patterns(self.words)))
+
+    def test_excluded_files_are_not_iterated(self):
+        included = self.write(os.path.join("src", "a.py"), b"")
+        self.write(os.path.join(".git", "HEAD"), b"")
+        self.write(os.path.join("src", "a.pyc"), b"")
+        self.assertEqual([included], list(occurrences.iterate_files([self.folder], [".git"], ["*.pyc"])))
+
+class TestOccurrenceIndex(unittest.TestCase):
+    def test_summary_counts_occurrences(self):
+        index = occurrences.OccurrenceIndex(["a", "b"])
+        index.add("x.txt", {"a": [(1, 2), (3, 1)]})
+        index.add("y.txt", {"a": [(2, 1)], "b": [(2, 1)]})
+        index.add("z.txt", None)
+        self.assertEqual(["Occurrences in 2 of 3 files:", "    a: 4 in 2 files", "    b: 1 in 1 files"], index.format_summary())
+        self.assertEqual(["y.txt:2: a, b"], index.format_hits("y.txt", index.files["y.txt"]))
+        self.assertEqual(["x.txt:1: a (2)", "x.txt:3: a"], index.format_hits("x.txt", index.files["x.txt"]))
@@ -0,0 +1,44 @@
+import sublime
+import unittest
+from unittest.mock import patch
+
+from word_highlighter.sublime_plugin import plugin_loaded
+plugin_loaded()
+
+import word_highlighter.src.stats as stats
+from word_highlighter.tests.setup import SublimeText_TestCase
+
+class TestRollingHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = stats.RollingHistogram()
+        for i in range(1, 101):
+            histogram.add(i)
+        self.assertEqual([50, 95, 99], histogram.percentiles())
+
+    def test_only_recent_samples_are_kept(self):
+        histogram = stats.RollingHistogram(size=2)
+        for i in range(5):
+            histogram.add(i)
+        self.assertEqual([3], histogram.percentiles((1,)))
+        self.assertEqual(5, histogram.count)
+
+    def test_no_samples(self):
+        self.assertEqual([None], stats.RollingHistogram().percentiles((50,)))
+
+class TestTimer(SublimeText_TestCase):
+    def tearDown(self):
+        stats.forget_stats(self.view)
+        super(TestTimer, self).tearDown()
+
+    def test_disabled_timer_records_nothing(self):
+        with patch.object(stats, "enabled", False):
+            with stats.timer(self.view, "phase"):
+                pass
+        self.assertNotIn(self.view.id(), stats.histograms)
+
+    def test_enabled_timer_records_phase(self):
+        with patch.object(stats, "enabled", True):
+            with stats.timer(self.view, "phase"):
+                pass
+        self.assertEqual(1, stats.histograms[self.view.id()]["phase"].count)
+        self.assertIn("phase", stats.get_summary(self.view))
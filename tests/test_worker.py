@@ -0,0 +1,114 @@
+import sublime
+from unittest.mock import MagicMock, patch
+
+from word_highlighter.sublime_plugin import plugin_loaded
+plugin_loaded()
+
+import word_highlighter.src.core as core
+import word_highlighter.src.worker as worker
+from word_highlighter.tests.setup import WordHighlighter_TestCase
+
+class TestScanJob(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestScanJob, self).setUp()
+        self.set_buffer("word1 word2")
+        self.word = core.WordHighlight("word1", match_by_word=True, literal_match=True)
+        self.collection._add_word(self.word)
+
+    def run_job(self, job):
+        with patch("sublime.set_timeout") as set_timeout_mock:
+            job.run()
+        for call in set_timeout_mock.call_args_list:
+            call[0][0]()
+
+    def test_job_is_committed(self):
+        on_commit = MagicMock()
+        self.run_job(worker.ScanJob(self.collection, on_commit=on_commit))
+        self.assertEqual(1, len(self.view.get_regions(self.word.get_key())))
+        self.assertTrue(on_commit.called)
+
+    def test_stale_job_is_dropped(self):
+        on_commit = MagicMock()
+        job = worker.ScanJob(self.collection, on_commit=on_commit)
+        self.set_buffer("word1 word1")
+        self.assertTrue(job.is_stale())
+        self.run_job(job)
+        self.assertEqual(0, len(self.view.get_regions(self.word.get_key())))
+        self.assertFalse(on_commit.called)
+
+    def test_job_is_dropped_when_words_change(self):
+        job = worker.ScanJob(self.collection)
+        self.collection._remove_word(self.word)
+        self.run_job(job)
+        self.assertEqual(0, len(self.view.get_regions(self.word.get_key())))
+
+    def test_scan_uses_the_state_at_submission(self):
+        self.collection.update()
+        job = worker.ScanJob(self.collection, [sublime.Region(0, 5)])
+        # The collection changes on the UI thread while the job waits for the worker
+        self.collection._remove_word(self.word)
+        with patch.object(self.collection, "get_dirty_windows", return_value=[sublime.Region(0, 11)]) as get_dirty_windows_mock:
+            with patch("sublime.set_timeout"):
+                job.run()
+        self.assertTrue(get_dirty_windows_mock.called, "The scan is incremental, like when the job was made")
+
+class TestScanWorker(WordHighlighter_TestCase):
+    def test_newer_job_replaces_pending_job(self):
+        scan_worker = worker.ScanWorker()
+        first = worker.ScanJob(self.collection)
+        second = worker.ScanJob(self.collection)
+        scan_worker.submit(first)
+        scan_worker.submit(second)
+        self.assertTrue(first.cancelled)
+        self.assertEqual([second], list(scan_worker.jobs.values()))
+
+    def test_jobs_of_running_view_wait(self):
+        scan_worker = worker.ScanWorker()
+        other_view = self.window.new_file()
+        self.addCleanup(other_view.close)
+        first = worker.ScanJob(self.collection)
+        second = worker.ScanJob(core.WordHighlightCollection(other_view))
+        scan_worker.running[self.view.id()] = first
+        scan_worker.submit(worker.ScanJob(self.collection))
+        scan_worker.submit(second)
+        self.assertTrue(first.cancelled)
+        self.assertIs(second, scan_worker.next_job())
+        self.assertIsNone(scan_worker.next_job())
+
+class TestAdaptiveDebounce(WordHighlighter_TestCase):
+    def setUp(self):
+        super(TestAdaptiveDebounce, self).setUp()
+        self.settings = {"adaptive_debounce": True, "debounce": 0.1, "debounce_min": 0.02, "debounce_max": 2.0, "debounce_cpu_share": 0.25}
+        patcher = patch("word_highlighter.src.helpers.get_settings")
+        get_settings_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        get_settings_mock.return_value.get.side_effect = lambda key, default=None: self.settings.get(key, default)
+        self.debounce = worker.AdaptiveDebounce(self.view)
+
+    def test_initial_delay(self):
+        self.assertEqual(0.1, self.debounce.get_delay())
+
+    def test_delay_keeps_cpu_share(self):
+        self.debounce.add_cost(0.1)
+        self.assertAlmostEqual(0.3, self.debounce.get_delay())
+
+    def test_delay_is_limited(self):
+        self.debounce.add_cost(0.001)
+        self.assertEqual(0.02, self.debounce.get_delay())
+        for _ in range(10):
+            self.debounce.add_cost(10)
+        self.assertEqual(2.0, self.debounce.get_delay())
+
+    def test_noticeable_changes_are_logged(self):
+        with patch.object(worker.logger, "info") as info_mock:
+            self.debounce.add_cost(0.1)
+            self.debounce.add_cost(0.1)
+            self.debounce.add_cost(0.11)
+            self.assertEqual(1, info_mock.call_count)
+            self.debounce.add_cost(10)
+            self.assertEqual(2, info_mock.call_count)
+
+    def test_not_adaptive(self):
+        self.settings["adaptive_debounce"] = False
+        self.debounce.add_cost(1)
+        self.assertEqual(0.1, self.debounce.get_delay())